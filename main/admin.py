@@ -40,9 +40,9 @@ class AlarmConfigInline(admin.TabularInline):
 
 @admin.register(Device)
 class DeviceAdmin(admin.ModelAdmin):
-    list_display = ("alias", "ip_address", "port", "protocol", "is_active")
+    list_display = ("alias", "ip_address", "port", "protocol", "poll_rate", "is_active")
     list_filter = ("protocol", "is_active")
-    search_fields = ("alias", "ip_address")
+    search_fields = ("alias", "ip_address", "serial_port")
     inlines = [TagInline]
 
 
@@ -3,6 +3,7 @@ from rest_framework import serializers
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from ..models import Device, Tag, AlarmConfig, ActivatedAlarm, AlarmSubscription, Dashboard, DashboardWidget, TagWriteRequest, Schedule
+from ..services.live_values import get_read_time
 
 
 class DurationSecondsField(serializers.IntegerField):
@@ -75,7 +76,7 @@ class TagSerializer(CleanedModelSerializer):
 class TagValueSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(source='external_id', read_only=True)
     value = serializers.JSONField(source='current_value', read_only=True)
-    time = serializers.DateTimeField(source='last_updated', read_only=True)
+    time = serializers.SerializerMethodField(read_only=True)
     age = serializers.SerializerMethodField(read_only=True)
     alarm = serializers.SerializerMethodField(read_only=True)
 
@@ -83,11 +84,15 @@ class TagValueSerializer(serializers.ModelSerializer):
         model = Tag
         fields = ["id", "value", "time", "age", "alarm"]
 
+    def get_time(self, obj: Tag):
+        return serializers.DateTimeField().to_representation(get_read_time(obj))
+
     def get_age(self, obj: Tag):
-        if(obj.last_updated is None):
+        read_time = get_read_time(obj)
+        if(read_time is None):
             return "Infinity"
         else:
-            return (timezone.now() - obj.last_updated).total_seconds() * 1000 #TODO just send the server time with the multi tag response?
+            return (timezone.now() - read_time).total_seconds() * 1000 #TODO just send the server time with the multi tag response?
 
     def get_alarm(self, obj: Tag):
         alarm: ActivatedAlarm = self.context.get("alarm_map", {}).get(obj.id)
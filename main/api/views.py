@@ -13,6 +13,8 @@ from .serializers import ScheduleSerializer
 from .serializers import DashboardSerializer, DashboardWidgetSerializer, DashboardWidgetBulkSerializer
 from .serializers import DeviceSerializer
 from ..models import DashboardWidget, Dashboard, Tag, Device, AlarmConfig, ActivatedAlarm, TagWriteRequest, TagHistoryEntry, Schedule
+from ..services.write_queue import write_queue
+from ..services.live_values import live_values
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from django.utils import timezone
 from django.db import transaction
@@ -61,13 +63,14 @@ class TagViewSet(ReadOnlyViewSet):
     
 
 class TagMetadataView(APIView):
-    """ Returns the available choices for Channels and Data Types """
+    """ Returns the available choices for Channels, Data Types and Scan Classes """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         return Response({
             "channels": [{"value": k, "label": v} for k, v in Tag.ChannelChoices.choices],
             "data_types": [{"value": k, "label": v} for k, v in Tag.DataTypeChoices.choices],
+            "scan_classes": [{"value": k, "label": v} for k, v in Tag.ScanClassChoices.choices],
         })
     
 
@@ -82,7 +85,10 @@ class TagWriteRequestViewSet(ModelViewSet):
         if tag.restricted_write and not user.is_staff:
             raise PermissionDenied("This tag is set to read-only.")
 
-        serializer.save(user=user)
+        write_request = serializer.save(user=user)
+
+        # Send it to the poller right away instead of waiting for a sweep
+        transaction.on_commit(lambda: write_queue.submit(write_request))
 
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
@@ -254,10 +260,14 @@ class TagMultiValueView(APIView):
 
     def get(self, request: HttpRequest):
         ids: str = request.query_params.get("tags", "")
-        tags = list(Tag.objects.filter(external_id__in=ids.split(",")))
+        values, missing = live_values.get(ids.split(","))
+        if not missing:
+            return Response(values)
+
+        tags = list(Tag.objects.filter(external_id__in=missing))
         serialized = TagValueSerializer(tags, many=True, context={"alarm_map": ActivatedAlarm.get_tag_map(tags)})
 
-        return Response(serialized.data)
+        return Response(values + serialized.data)
     
 
 class TagHistoryView(ListAPIView):
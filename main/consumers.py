@@ -1,44 +1,87 @@
 import json
+import time
+import asyncio
+from django.utils import timezone
 from channels.generic.websocket import AsyncWebsocketConsumer
+from .services.subscriptions import subscriptions
+from .services.live_values import live_values
+from .services.tag_updates import FRAME_SNAPSHOT, build_frame, build_binary_frame, format_time
 
 class DashboardConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        """ Start accepting user subscriptions and poller updates """
-
-        self.group_name = "poller_broadcast"
-        self.subscribed_tags = set()
-
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
-        )
+        """ Start accepting user subscriptions. The poller sends updates straight to this channel """
+        self.binary = False
+        self.next_frame = 0.0
+        self.flush_task: asyncio.Task | None = None
         await self.accept()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
+        if self.flush_task:
+            self.flush_task.cancel()
+        subscriptions.unsubscribe(self.channel_name)
 
     async def receive(self, text_data):
         """ Handle widget subscriptions """
 
         data = json.loads(text_data)
         
-        if data.get("type") == "subscribe":
-            new_tags = set(data.get("tags", []))
-            self.subscribed_tags.update(new_tags)
+        match data.get("type"):
+            case "subscribe":
+                tags = data.get("tags", [])
+                subscriptions.subscribe(self.channel_name, tags)
+
+                # Clients that ask for the binary protocol get handles for their tags before any binary frame uses them
+                if data.get("protocol") == "binary":
+                    self.binary = True
+                    await self.send(text_data=json.dumps({"type": "handles", "handles": subscriptions.get_handles(tags)}))
+
+                await self.send_snapshot(tags)
+            case "unsubscribe":
+                subscriptions.unsubscribe(self.channel_name, data.get("tags", []))
+
+    async def send_snapshot(self, tags: list[str]):
+        """ Send the current values of newly subscribed tags, so the client needn't fetch them """
+
+        updates = await live_values.snapshot(tags)
+        if not updates:
+            return
+
+        now = timezone.now()
+        if self.binary:
+            await self.send(bytes_data=build_binary_frame(now.timestamp() * 1000, subscriptions.packed_handles, updates, FRAME_SNAPSHOT))
+        else:
+            await self.send(text_data=build_frame(format_time(now), (fragment for _, fragment, _ in updates), "snapshot"))
 
     async def tag_update(self, event):
-        """ Handle update message from poller """
+        """ Send the updates queued for this user's subscriptions, at most max_frame_rate times a second.
+        A frame that must wait is sent from its own task, so subscription messages aren't held up behind it """
 
-        all_updates = event["updates"]
-        
-        # Send updates for this user's subscription
-        relevant_updates = [u for u in all_updates if u["id"] in self.subscribed_tags]
-
-        if relevant_updates:
-            await self.send(text_data=json.dumps({
-                "type": "tag_update",
-                "data": relevant_updates
-            }))
\ No newline at end of file
+        if self.flush_task and not self.flush_task.done():
+            return
+
+        wait = self.next_frame - time.monotonic()
+        if wait > 0:
+            self.flush_task = asyncio.create_task(self.flush(wait))
+        else:
+            await self.flush()
+
+    async def flush(self, delay=0.0):
+        """ Send everything queued. Updates arriving during the delay or a slow send replace the queued ones.
+        Their wake-up may have come while this was still running, so anything left after the send gets its own frame """
+
+        if delay:
+            await asyncio.sleep(delay)
+
+        server_time, server_ms, updates = subscriptions.take(self.channel_name)
+        if not updates:
+            return
+
+        self.next_frame = time.monotonic() + subscriptions.frame_interval
+
+        if self.binary:
+            await self.send(bytes_data=build_binary_frame(server_ms, subscriptions.packed_handles, updates))
+        else:
+            await self.send(text_data=build_frame(server_time, (fragment for _, fragment, _ in updates)))
+
+        if subscriptions.has_pending(self.channel_name):
+            self.flush_task = asyncio.create_task(self.flush(max(self.next_frame - time.monotonic(), 0.0)))
@@ -0,0 +1,78 @@
+import json
+import time
+import random
+import uuid
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from main.models import Tag
+from main.services.runtime_tags import RuntimeTag
+from main.services.subscriptions import SubscriptionIndex
+from main.services.tag_updates import encode_updates, build_frame, format_time
+
+class Command(BaseCommand):
+    help = "Compare encoding websocket updates per consumer against encoding each tag once and splicing frames, for growing numbers of consumers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tags", type=int, default=2000, help="Tags updated each cycle")
+        parser.add_argument("--subscribed", type=int, default=300, help="Tags each consumer subscribes to")
+        parser.add_argument("--consumers", type=int, nargs="+", default=[1, 10, 50, 200])
+        parser.add_argument("--cycles", type=int, default=20)
+        parser.add_argument("--block-size", type=int, default=50, help="Tags per block read, which share a read time")
+
+    def handle(self, *args, **options):
+        tags = [_make_tag(i) for i in range(options["tags"])]
+
+        # Tags read in the same block share a read time
+        for i in range(0, len(tags), options["block_size"]):
+            read_at = timezone.now()
+            for tag in tags[i : i + options["block_size"]]:
+                tag.read_at = read_at
+        ids = [t.external_id for t in tags]
+
+        self.stdout.write(f"{options['tags']} updated tags per cycle, {options['subscribed']} subscribed per consumer")
+
+        for count in options["consumers"]:
+            index = SubscriptionIndex()
+            for i in range(count):
+                index.subscribe(f"consumer {i}", random.sample(ids, min(options["subscribed"], len(ids))))
+
+            per_consumer = _time_cycles(options["cycles"], lambda: _encode_per_consumer(index, tags))
+            spliced = _time_cycles(options["cycles"], lambda: _encode_once(index, tags))
+
+            self.stdout.write(
+                f"{count} consumers: {per_consumer * 1000:.2f}ms per cycle encoding per consumer, "
+                f"{spliced * 1000:.2f}ms encoding once and splicing ({per_consumer / spliced:.1f}x)"
+            )
+
+
+def _encode_per_consumer(index: SubscriptionIndex, tags: list[RuntimeTag]) -> list[str]:
+    """ The old path: build each consumer's slice as dicts and dump it as a whole """
+
+    server_time = format_time(timezone.now())
+    updates = [{"id": t.external_id, "value": t.value, "time": format_time(t.read_at), "alarm": None} for t in tags]
+
+    slices = {}
+    for update in updates:
+        for consumer in index.subscribers.get(update["id"], ()):
+            slices.setdefault(consumer, []).append(update)
+
+    return [json.dumps({"type": "tag_update", "server_time": server_time, "data": data}) for data in slices.values()]
+
+
+def _encode_once(index: SubscriptionIndex, tags: list[RuntimeTag]) -> list[str]:
+    server_time = format_time(timezone.now())
+    slices = index.route(encode_updates(tags, {}))
+    return [build_frame(server_time, (fragment for _, fragment, _ in updates)) for updates in slices.values()]
+
+
+def _time_cycles(cycles: int, cycle) -> float:
+    start = time.perf_counter()
+    for _ in range(cycles):
+        cycle()
+    return (time.perf_counter() - start) / cycles
+
+
+def _make_tag(i: int) -> RuntimeTag:
+    tag = RuntimeTag(Tag(id=i + 1, alias=f"tag {i}", external_id=uuid.uuid4(), channel=Tag.ChannelChoices.HOLDING_REGISTER, data_type=Tag.DataTypeChoices.FLOAT32))
+    tag.value = random.uniform(-100, 100)
+    return tag
@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+from pymodbus.server import ModbusTcpServer
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusDeviceContext, ModbusServerContext
+from main.models import Device, Tag, ConfigVersion
+from main.services.ipc import PollerHub
+
+# Repeating tag layout for the synthetic devices: (channel, data type, registers per tag)
+TAG_MIX = [
+    (Tag.ChannelChoices.HOLDING_REGISTER, Tag.DataTypeChoices.FLOAT32, 2),
+    (Tag.ChannelChoices.HOLDING_REGISTER, Tag.DataTypeChoices.UINT16, 1),
+    (Tag.ChannelChoices.INPUT_REGISTER, Tag.DataTypeChoices.INT16, 1),
+    (Tag.ChannelChoices.INPUT_REGISTER, Tag.DataTypeChoices.FLOAT32, 2),
+    (Tag.ChannelChoices.COIL, Tag.DataTypeChoices.BOOL, 1),
+    (Tag.ChannelChoices.DISCRETE_INPUT, Tag.DataTypeChoices.BOOL, 1),
+]
+
+ALIAS_PREFIX = "bench-device-"
+
+class Command(BaseCommand):
+    help = (
+        "Measure poller throughput as run_server --shards runs it: run_poller workers read simulated devices and report "
+        "to a poller hub in this process, for 1, 2, 4... workers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--devices", type=int, default=50)
+        parser.add_argument("--tags", type=int, default=120, help="Tags per device")
+        parser.add_argument("--poll-interval", type=float, default=0.25, help="Seconds between reads of each device")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds each run is measured for")
+        parser.add_argument("--warmup", type=float, default=3.0, help="Seconds each run polls before it is measured")
+        parser.add_argument("--max-workers", type=int, default=os.cpu_count(), help="Runs with 1, 2, 4... workers up to this many")
+        parser.add_argument("--modbus-port", type=int, default=5020, help="First local port of the simulated devices, one port each")
+        parser.add_argument("--ipc-port", type=int, default=8766, help="Local port of the poller hub")
+        parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options["serve"]:
+            asyncio.run(serve_devices(options["modbus_port"], options["devices"]))
+            return
+
+        others = Device.objects.filter(is_active=True).exclude(alias__startswith=ALIAS_PREFIX).count()
+        if others:
+            self.stderr.write(f"{others} other active devices will be polled along with the simulated ones")
+
+        create_devices(options["devices"], options["tags"], options["modbus_port"])
+        try:
+            asyncio.run(self.run_async(options))
+        finally:
+            with transaction.atomic():
+                Device.objects.filter(alias__startswith=ALIAS_PREFIX).delete()
+
+    async def run_async(self, options: dict):
+        target = options["devices"] * options["tags"] / options["poll_interval"]
+        self.stdout.write(
+            f"{options['devices']} devices x {options['tags']} tags every {options['poll_interval']}s "
+            f"({target:,.0f} tag reads/s), {options['duration']:.1f}s per run, {os.cpu_count()} CPUs"
+        )
+        self.stdout.write("Every read returns new values, so each tag read is an update sent through the hub")
+
+        output = None if options["verbosity"] > 1 else subprocess.DEVNULL
+        simulator = await asyncio.create_subprocess_exec(
+            sys.executable, str(settings.BASE_DIR / "manage.py"), "bench_poller", "--serve",
+            f"--modbus-port={options['modbus_port']}", f"--devices={options['devices']}",
+            stdout=output, stderr=output,
+        )
+
+        try:
+            baseline = None
+            counts = sorted({1, *(2 ** i for i in range(options["max_workers"].bit_length())), options["max_workers"]})
+            for workers in counts:
+                received, elapsed, cpu = await self.run_workers(workers, options)
+                rate = sum(received.values()) / elapsed
+                baseline = baseline or rate
+
+                per_worker = ", ".join(f"{received.get(i, 0) / elapsed:,.0f}" for i in range(workers))
+                self.stdout.write(
+                    f"{workers} workers: {rate:,.0f} updates/s ({rate / baseline:.2f}x, {rate / target:.0%} of target), "
+                    f"hub process CPU {cpu / elapsed:.0%}, per worker {per_worker}"
+                )
+        finally:
+            simulator.terminate()
+            await simulator.wait()
+
+    async def run_workers(self, workers: int, options: dict) -> tuple[dict[int, int], float, float]:
+        """ Poll with the given number of workers. Returns the updates the hub got from each, the seconds measured,
+        and the CPU seconds this process spent receiving them """
+
+        hub = PollerHub(workers)
+        hub_task = asyncio.create_task(hub.serve(options["ipc_port"]))
+        output = None if options["verbosity"] > 1 else subprocess.DEVNULL
+
+        processes = [
+            await asyncio.create_subprocess_exec(
+                sys.executable, str(settings.BASE_DIR / "manage.py"), "run_poller",
+                f"--shard={i}", f"--shards={workers}", f"--ipc-port={options['ipc_port']}",
+                f"--poll-interval={options['poll_interval']}", f"--fast-interval={options['poll_interval']}",
+                stdout=output, stderr=output,
+            )
+            for i in range(workers)
+        ]
+
+        try:
+            while len(hub.workers) < workers:
+                if any(p.returncode is not None for p in processes):
+                    raise CommandError("A poller worker exited before connecting. Run with -v 2 to see its output")
+                await asyncio.sleep(0.1)
+            await asyncio.sleep(options["warmup"])
+
+            hub.received.clear()
+            start, start_cpu = time.perf_counter(), time.process_time()
+            await asyncio.sleep(options["duration"])
+            return dict(hub.received), time.perf_counter() - start, time.process_time() - start_cpu
+
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                await process.wait()
+            hub_task.cancel()
+
+
+def create_devices(device_count: int, tag_count: int, first_port: int):
+    """ Save the simulated devices and their tags, one device per port """
+
+    with transaction.atomic():
+        Device.objects.filter(alias__startswith=ALIAS_PREFIX).delete()
+
+        devices = Device.objects.bulk_create(
+            Device(alias=f"{ALIAS_PREFIX}{i}", ip_address="127.0.0.1", port=first_port + i) for i in range(device_count)
+        )
+        Tag.objects.bulk_create(tag for device in devices for tag in _make_tags(device, tag_count))
+
+        # Bulk creates send no signals
+        ConfigVersion.bump()
+
+
+async def serve_devices(first_port: int, device_count: int):
+    """ Serve random data on each simulated device's port """
+
+    store = ModbusDeviceContext(
+        di=RandomDataBlock(2), co=RandomDataBlock(2),
+        hr=RandomDataBlock(0x10000), ir=RandomDataBlock(0x10000),
+    )
+    context = ModbusServerContext(devices=store, single=True)
+
+    servers = [ModbusTcpServer(context, address=("127.0.0.1", first_port + i)) for i in range(device_count)]
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+class RandomDataBlock(ModbusSequentialDataBlock):
+    """ Returns new values on every read, so every tag read is a change """
+
+    def __init__(self, high: int):
+        super().__init__(0, [0])
+        self.high = high
+        self.rng = np.random.default_rng()
+
+    def getValues(self, address, count=1):
+        return self.rng.integers(0, self.high, count).tolist()
+
+
+def _make_tags(device: Device, count: int) -> list[Tag]:
+    addresses = {}
+    tags = []
+    for i in range(count):
+        channel, data_type, size = TAG_MIX[i % len(TAG_MIX)]
+        address = addresses.get(channel, 0)
+        addresses[channel] = address + size
+
+        tags.append(Tag(
+            device=device, alias=f"tag {i}", unit_id=1,
+            channel=channel, data_type=data_type, address=address,
+        ))
+    return tags
@@ -0,0 +1,51 @@
+import signal
+import asyncio
+from django.core.management.base import BaseCommand
+from main.services.poll_devices import poll_devices
+from main.services.registry import registry
+from main.services.ipc import HubConnection
+
+class Command(BaseCommand):
+    help = "Run one shard of the Modbus poller, reporting to the web process started with run_server --shards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shard", type=int, required=True, help="Index of this worker's shard")
+        parser.add_argument("--shards", type=int, required=True, help="Total number of poller workers")
+        parser.add_argument("--ipc-port", type=int, default=8765, help="Local port of the web process's poller hub")
+        parser.add_argument("--poll-interval", type=float, default=0.25)
+        parser.add_argument("--fast-interval", type=float, default=0.1)
+        parser.add_argument("--demand-mode", choices=["off", "skip", "demote"], default="off")
+        parser.add_argument("--slow-interval", type=float, default=30)
+        parser.add_argument("--request-cost", type=float, default=0.01)
+        parser.add_argument("--register-cost", type=float, default=0.0001)
+        parser.add_argument("--flush-interval", type=float, default=1.0)
+        parser.add_argument("--flush-size", type=int, default=5000)
+        parser.add_argument("--checkpoint-interval", type=float, default=60)
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self.run_async(options))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+
+    async def run_async(self, options: dict):
+        # Stopping on SIGTERM, as sent by run_server, still lets the persister flush
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+
+        registry.set_shard(options["shard"], options["shards"])
+        hub = HubConnection(options["ipc_port"], options["shard"])
+
+        hub_task = asyncio.create_task(hub.run())
+        try:
+            await poll_devices(
+                poll_interval=options["poll_interval"], fast_interval=options["fast_interval"], slow_interval=options["slow_interval"],
+                demand_mode=options["demand_mode"],
+                request_cost=options["request_cost"], register_cost=options["register_cost"],
+                flush_interval=options["flush_interval"], flush_size=options["flush_size"], checkpoint_interval=options["checkpoint_interval"],
+                publisher=hub.publish, read_time_publisher=hub.publish_read_times
+            )
+        finally:
+            hub_task.cancel()
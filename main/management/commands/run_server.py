@@ -1,9 +1,19 @@
+import sys
 import asyncio
+import logging
 from uvicorn import Config, Server
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 from main.services.poll_devices import poll_devices
 from main.services.cleanup import loop_cleanup
 from main.services.scheduler import run_scheduler
+from main.services.ipc import PollerHub
+from main.services.subscriptions import subscriptions
+from main.services.live_values import live_values
+
+logger = logging.getLogger(__name__)
+
+POLL_OPTIONS = ["poll_interval", "fast_interval", "slow_interval", "demand_mode", "request_cost", "register_cost", "flush_interval", "flush_size", "checkpoint_interval"]
 
 class Command(BaseCommand):
     help = "Run Uvicorn with background Modbus poller"
@@ -11,24 +21,72 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--port", type=int, default=8000)
         parser.add_argument("--poll-interval", type=float, default=0.25)
+        parser.add_argument("--fast-interval", type=float, default=0.1, help="Seconds between reads of fast scan class tags")
+        parser.add_argument("--demand-mode", choices=["off", "skip", "demote"], default="off", help="Skip tags nobody needs, or demote them to the slow scan. Needed tags are on a live dashboard, or have history, an alarm or a schedule")
+        parser.add_argument("--slow-interval", type=float, default=30, help="Seconds between reads of slow scan class tags")
         parser.add_argument("--cleanup-interval", type=float, default=60)
+        parser.add_argument("--request-cost", type=float, default=0.01, help="Estimated seconds per read request, used when planning block reads")
+        parser.add_argument("--register-cost", type=float, default=0.0001, help="Estimated seconds per unused register read, used when planning block reads")
+        parser.add_argument("--flush-interval", type=float, default=1.0, help="Most seconds between writes of polled values to the DB")
+        parser.add_argument("--flush-size", type=int, default=5000, help="Queued tags that trigger an early write to the DB")
+        parser.add_argument("--checkpoint-interval", type=float, default=60, help="Seconds between writes of tag read times to the DB")
+        parser.add_argument("--shards", type=int, default=0, help="Poll in this many worker processes instead of the web process, split by device alias")
+        parser.add_argument("--max-frame-rate", type=float, default=10, help="Most websocket update frames sent to each client per second, or 0 for no limit. Values in between are conflated to the latest")
+        parser.add_argument("--ipc-port", type=int, default=8765, help="Local port the poller workers report to")
 
     def handle(self, *args, **options):
+        if options["max_frame_rate"] < 0:
+            raise CommandError("--max-frame-rate can't be negative")
+        subscriptions.max_frame_rate = options["max_frame_rate"]
+
+        # The pollers keep it current from here on
+        logger.info(f"Loaded {live_values.seed()} tag values")
+
         try:
-            asyncio.run(self.run_async(options["port"], options["poll_interval"], options["cleanup_interval"]))
+            asyncio.run(self.run_async(options["port"], options["cleanup_interval"], options["shards"], options["ipc_port"], {k: options[k] for k in POLL_OPTIONS}))
         except KeyboardInterrupt:
             pass
 
-    async def run_async(self, port: int, poll_interval: float, cleanup_interval: float):
+    async def run_async(self, port: int, cleanup_interval: float, shards: int, ipc_port: int, poll_options: dict):
         config = Config("modbus_tiles.asgi:application", host="0.0.0.0", port=port, lifespan="off")
         server = Server(config)
 
-        poll_task = asyncio.create_task(poll_devices(poll_interval=poll_interval))
+        if shards > 0:
+            hub = PollerHub(shards)
+            poll_tasks = [asyncio.create_task(hub.serve(ipc_port))]
+            poll_tasks += [asyncio.create_task(_run_worker(shard, shards, ipc_port, poll_options)) for shard in range(shards)]
+        else:
+            poll_tasks = [asyncio.create_task(poll_devices(**poll_options))]
+
         cleanup_task = asyncio.create_task(loop_cleanup(interval=cleanup_interval))
         scheduler_task = asyncio.create_task(run_scheduler())
 
         await server.serve()
 
-        poll_task.cancel()
+        for task in poll_tasks:
+            task.cancel()
         cleanup_task.cancel()
-        scheduler_task.cancel()
\ No newline at end of file
+        scheduler_task.cancel()
+
+        await asyncio.gather(*poll_tasks, return_exceptions=True)
+
+
+async def _run_worker(shard: int, shards: int, ipc_port: int, poll_options: dict, restart_delay=2.0):
+    """ Keep a poller worker process running, restarting it if it exits """
+
+    args = [sys.executable, str(settings.BASE_DIR / "manage.py"), "run_poller", f"--shard={shard}", f"--shards={shards}", f"--ipc-port={ipc_port}"]
+    args += [f"--{name.replace('_', '-')}={value}" for name, value in poll_options.items()]
+
+    while True:
+        process = await asyncio.create_subprocess_exec(*args)
+        logger.info(f"Started poller worker {shard} (pid {process.pid})")
+
+        try:
+            code = await process.wait()
+        except asyncio.CancelledError:
+            process.terminate()
+            await process.wait()
+            raise
+
+        logger.warning(f"Poller worker {shard} exited with code {code}, restarting in {restart_delay:.1f}s")
+        await asyncio.sleep(restart_delay)
@@ -4,7 +4,8 @@ import logging
 from abc import ABC
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
-from pymodbus.server import StartTcpServer
+from pymodbus import FramerType
+from pymodbus.server import StartTcpServer, StartSerialServer
 from pymodbus.datastore import (
     ModbusSequentialDataBlock,
     ModbusDeviceContext,
@@ -17,11 +18,13 @@ logger = logging.getLogger(__name__)
 User = get_user_model()
 
 class Command(BaseCommand, ABC):
-    help = 'Runs a Modbus TCP simulator'
+    help = 'Runs a Modbus TCP or RTU simulator'
 
     def add_arguments(self, parser):
         parser.add_argument("--interval", type=float, default=0.1)
         parser.add_argument("--size", type=int, default=2**13)
+        parser.add_argument("--serial-port", help="Serve Modbus RTU on this serial device (e.g. one end of a pty pair) instead of TCP")
+        parser.add_argument("--baud-rate", type=int, default=9600)
 
     def handle(self, *args, **options): #TODO word order
         self.interval = options["interval"]
@@ -46,8 +49,12 @@ class Command(BaseCommand, ABC):
         thread.start()
 
         # Server
-        logger.info(f"Simulator running on port {self.port}")
-        StartTcpServer(context=self.context, address=("0.0.0.0", self.port))
+        if options["serial_port"]:
+            logger.info(f"Simulator running on {options['serial_port']} at {options['baud_rate']} baud")
+            StartSerialServer(context=self.context, framer=FramerType.RTU, port=options["serial_port"], baudrate=options["baud_rate"])
+        else:
+            logger.info(f"Simulator running on port {self.port}")
+            StartTcpServer(context=self.context, address=("0.0.0.0", self.port))
 
     def _loop(self):
         while True:
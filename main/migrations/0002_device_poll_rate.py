@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='poll_rate',
+            field=models.FloatField(blank=True, help_text='Seconds between polls. Uses the poller interval if empty', null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_device_poll_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
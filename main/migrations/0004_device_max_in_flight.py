@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 01:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_configversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='max_in_flight',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Read requests that may be outstanding at once. Above 1 pipelines Modbus TCP reads'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_device_max_in_flight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='deadband',
+            field=models.FloatField(default=0, help_text='Smallest absolute change that updates the current value'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='deadband_percent',
+            field=models.FloatField(default=0, help_text='Smallest change, as a percent of the last value, that updates the current value'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 01:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_tag_deadband_tag_deadband_percent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='read_back_writes',
+            field=models.BooleanField(default=False, help_text='Re-read tags right after writing them, so the confirmed value shows before the next poll'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_device_read_back_writes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='baud_rate',
+            field=models.PositiveIntegerField(default=9600),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='parity',
+            field=models.TextField(choices=[('N', 'None'), ('E', 'Even'), ('O', 'Odd')], default='N'),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='serial_port',
+            field=models.CharField(blank=True, help_text='Serial device for Modbus RTU, e.g. /dev/ttyUSB0 or COM3', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='stop_bits',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_device_baud_rate_device_parity_device_serial_port_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='request_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds to wait for each reply. Adapts to the measured latency if empty', null=True),
+        ),
+    ]
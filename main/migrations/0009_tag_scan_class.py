@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 02:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_device_request_timeout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='scan_class',
+            field=models.TextField(choices=[('fast', 'Fast'), ('normal', 'Normal'), ('slow', 'Slow')], default='normal', help_text="How often the tag is read. Normal tags use the device's poll rate"),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 02:29
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_tag_scan_class'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='device',
+            name='poll_rate',
+            field=models.FloatField(blank=True, help_text='Seconds between polls. Uses the poller interval if empty', null=True, validators=[django.core.validators.MinValueValidator(0.05)]),
+        ),
+    ]
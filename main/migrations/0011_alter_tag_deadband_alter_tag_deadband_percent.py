@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 03:36
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_alter_device_poll_rate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tag',
+            name='deadband',
+            field=models.FloatField(default=0, help_text='Smallest absolute change that updates the current value', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='deadband_percent',
+            field=models.FloatField(default=0, help_text='Smallest change, as a percent of the last value, that updates the current value', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 03:36
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_alter_tag_deadband_alter_tag_deadband_percent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='device',
+            name='max_in_flight',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Read requests that may be outstanding at once. Above 1 pipelines Modbus TCP reads', validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 03:37
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_alter_device_max_in_flight'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='device',
+            name='request_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds to wait for each reply. Adapts to the measured latency if empty', null=True, validators=[django.core.validators.MinValueValidator(0.01)]),
+        ),
+    ]
@@ -8,12 +8,19 @@ from django.utils import timezone
 from django.utils.text import slugify
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
 from pymodbus.client.base import ModbusBaseClient
 
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
+# Shortest poll rate a device may set, in seconds
+MIN_POLL_RATE = 0.05
+
+# Shortest reply timeout a device may set, in seconds
+MIN_REQUEST_TIMEOUT = 0.01
+
 
 class Device(models.Model):
     """ Represents a single PLC that should be connected to via Modbus """
@@ -27,21 +34,68 @@ class Device(models.Model):
         BIG = "big", "Big Endian"
         LITTLE = "little", "Little Endian"
 
+    class ParityChoices(models.TextChoices):
+        NONE = "N", "None"
+        EVEN = "E", "Even"
+        ODD = "O", "Odd"
+
     alias = models.SlugField(max_length=100, unique=True) #TODO regular string field?
     ip_address = models.GenericIPAddressField(default="127.0.0.1")
     port = models.PositiveIntegerField(default=502)
+    serial_port = models.CharField(max_length=200, blank=True, help_text="Serial device for Modbus RTU, e.g. /dev/ttyUSB0 or COM3")
+    baud_rate = models.PositiveIntegerField(default=9600)
+    parity = models.TextField(choices=ParityChoices.choices, default=ParityChoices.NONE)
+    stop_bits = models.PositiveSmallIntegerField(default=1)
     protocol = models.TextField(choices=ProtocolChoices.choices, default=ProtocolChoices.MODBUS_TCP)
     word_order = models.TextField(choices=WordOrderChoices.choices, default=WordOrderChoices.BIG)
-    #poll_rate = models.FloatField(default=0.5)
+    poll_rate = models.FloatField(null=True, blank=True, validators=[MinValueValidator(MIN_POLL_RATE)], help_text="Seconds between polls. Uses the poller interval if empty")
+    max_in_flight = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1)], help_text="Read requests that may be outstanding at once. Above 1 pipelines Modbus TCP reads")
+    request_timeout = models.FloatField(null=True, blank=True, validators=[MinValueValidator(MIN_REQUEST_TIMEOUT)], help_text="Seconds to wait for each reply. Adapts to the measured latency if empty")
+    read_back_writes = models.BooleanField(default=False, help_text="Re-read tags right after writing them, so the confirmed value shows before the next poll")
 
     is_active = models.BooleanField(default=True)
 
     #created_at = models.DateTimeField(auto_now_add=True)
 
+    def clean(self):
+        if self.protocol == Device.ProtocolChoices.MODBUS_RTU and not self.serial_port:
+            raise ValidationError({ "serial_port": "Modbus RTU devices need a serial port" })
+
+        if self.protocol == Device.ProtocolChoices.MODBUS_RTU:
+            # Every device on a serial bus shares one connection, so they must agree on its settings
+            conflict = (
+                Device.objects.filter(protocol=self.protocol, serial_port=self.serial_port)
+                .exclude(pk=self.pk)
+                .exclude(baud_rate=self.baud_rate, parity=self.parity, stop_bits=self.stop_bits)
+                .first()
+            )
+            if conflict:
+                raise ValidationError({ "serial_port": f"{conflict.alias} uses this port with {conflict.baud_rate} baud, parity {conflict.parity} and {conflict.stop_bits} stop bits" })
+
     def __str__(self):
+        if self.protocol == Device.ProtocolChoices.MODBUS_RTU:
+            return f"{self.alias} ({self.serial_port} @ {self.baud_rate})"
         return f"{self.alias} ({self.ip_address}:{self.port})"
     
 
+class ConfigVersion(models.Model):
+    """ Counter that is bumped whenever device or tag configuration changes """
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=models.F("version") + 1):
+            cls.objects.get_or_create(pk=1, defaults={"version": 1})
+
+    @classmethod
+    def current(cls) -> int:
+        return cls.objects.filter(pk=1).values_list("version", flat=True).first() or 0
+
+    def __str__(self):
+        return f"Config version {self.version}"
+
+
 class Tag(models.Model):
     """ Represents a portion of data that should be read from a PLC """
 
@@ -63,6 +117,11 @@ class Tag(models.Model):
         FLOAT64 = "float64", "Float64"
         STRING = "string", "String"
 
+    class ScanClassChoices(models.TextChoices):
+        FAST = "fast", "Fast"
+        NORMAL = "normal", "Normal"
+        SLOW = "slow", "Slow"
+
     device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name="tags")
     unit_id = models.PositiveIntegerField(default=1)
     owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -78,6 +137,10 @@ class Tag(models.Model):
     bit_index = models.PositiveSmallIntegerField(default=0)
 
     read_amount = models.PositiveIntegerField(default=1)
+    scan_class = models.TextField(choices=ScanClassChoices.choices, default=ScanClassChoices.NORMAL, help_text="How often the tag is read. Normal tags use the device's poll rate")
+
+    deadband = models.FloatField(default=0, validators=[MinValueValidator(0)], help_text="Smallest absolute change that updates the current value")
+    deadband_percent = models.FloatField(default=0, validators=[MinValueValidator(0)], help_text="Smallest change, as a percent of the last value, that updates the current value")
 
     last_history_at = models.DateTimeField(null=True, blank=True)
     history_interval = models.DurationField(default=timedelta(seconds=1))
@@ -166,6 +229,12 @@ class Tag(models.Model):
     def clean(self):
         if not (0 <= self.bit_index <= 15):
             raise ValidationError({ "bit_index": "Bit index must be between 0 and 15" })
+
+        if self.deadband < 0:
+            raise ValidationError({ "deadband": "Deadband can't be negative" })
+
+        if self.deadband_percent < 0:
+            raise ValidationError({ "deadband_percent": "Deadband percent can't be negative" })
         
         self_size = self.get_read_count()
         self_start = self.address
@@ -260,11 +329,11 @@ class AlarmConfig(models.Model):
     last_notified = models.DateTimeField(null=True, blank=True)
 
     @classmethod
-    def update_alarms(cls, tags: list[Tag]):
-        """ Activate or deactivate alarms for the given tags """
+    def update_alarms(cls, tags: list[Tag]) -> dict[int, "ActivatedAlarm | None"]:
+        """ Activate or deactivate alarms for the given tags. Returns the new alarm, or None, for each tag whose alarm changed """
 
         if not tags:
-            return
+            return {}
         
         # Active alarms for affected tags only
         active_map = ActivatedAlarm.get_tag_map(tags)
@@ -276,6 +345,7 @@ class AlarmConfig(models.Model):
 
         deactivate = []
         activate = []
+        changes: dict[int, ActivatedAlarm | None] = {}
 
         for tag in tags:
             configs = configs_by_tag.get(tag.id, [])
@@ -291,17 +361,21 @@ class AlarmConfig(models.Model):
                 current.is_active = False
                 current.resolved_at = timezone.now()
                 deactivate.append(current)
+                changes[tag.id] = None
                 logger.info(f"Alarm Deactivated: {current.config}")
 
             if winning and (not current or current.config_id != winning.id):
                 # Activate the alarm
                 alarm = ActivatedAlarm(config=winning, is_active=True)
                 activate.append(alarm)
+                changes[tag.id] = alarm
                 logger.info(f"Alarm Activated: {winning}")
 
         ActivatedAlarm.objects.bulk_update(deactivate, ["is_active", "resolved_at"])
         ActivatedAlarm.objects.bulk_create(activate)
 
+        return changes
+
     def is_activation(self, value):
         try:
             match self.operator:
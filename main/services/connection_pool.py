@@ -0,0 +1,165 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from pymodbus.client import AsyncModbusTcpClient, AsyncModbusUdpClient
+from pymodbus.client.base import ModbusBaseClient
+from ..models import Device
+from .modbus_clients import PipelinedTcpClient, SerialBusClient
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Endpoint:
+    """ One connection to a PLC, gateway or serial bus, shared by every device behind it """
+    protocol: str
+    host: str = ""
+    port: int = 0
+    serial_port: str = ""
+    baud_rate: int = 0
+    parity: str = Device.ParityChoices.NONE
+    stop_bits: int = 1
+    aliases: set[str] = field(default_factory=set)
+    max_in_flight: int = 1
+    client: ModbusBaseClient | None = None
+    failures: int = 0
+    disabled_until: float = 0.0
+    connecting: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def line_settings(self) -> tuple:
+        """ Serial line settings, left at their defaults for TCP and UDP """
+        return (self.baud_rate, self.parity, self.stop_bits)
+
+    @property
+    def pipelined(self) -> bool:
+        return self.protocol == Device.ProtocolChoices.MODBUS_TCP and self.max_in_flight > 1
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def __str__(self):
+        if self.protocol == Device.ProtocolChoices.MODBUS_RTU:
+            return f"{self.serial_port} @ {self.baud_rate}"
+        return f"{self.protocol}://{self.host}:{self.port}"
+
+
+class ConnectionPool:
+    """ Modbus clients keyed by (protocol, host, port), or (protocol, serial port) for RTU, so devices behind one gateway or on one serial bus share a connection """
+
+    def __init__(self, base_backoff_seconds=2, max_backoff_seconds=60):
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.endpoints: dict[tuple, Endpoint] = {}
+
+    @staticmethod
+    def endpoint_key(device: Device) -> tuple:
+        # A serial port is one bus whatever its settings, so it must only be opened once
+        if device.protocol == Device.ProtocolChoices.MODBUS_RTU:
+            return (device.protocol, device.serial_port)
+        return (device.protocol, device.ip_address, device.port)
+
+    def _new_endpoint(self, device: Device) -> Endpoint:
+        if device.protocol == Device.ProtocolChoices.MODBUS_RTU:
+            return Endpoint(device.protocol, serial_port=device.serial_port, baud_rate=device.baud_rate, parity=device.parity, stop_bits=device.stop_bits)
+        return Endpoint(device.protocol, host=device.ip_address, port=device.port)
+
+    def sync(self, devices: dict[str, Device]):
+        """ Match the endpoints to the loaded devices, closing ones nobody uses or whose client type or serial settings changed """
+
+        wanted: dict[tuple, Endpoint] = {}
+        for alias, device in devices.items():
+            key = self.endpoint_key(device)
+            endpoint = wanted.get(key)
+            if endpoint is None:
+                endpoint = wanted[key] = self._new_endpoint(device)
+            elif device.protocol == Device.ProtocolChoices.MODBUS_RTU and endpoint.line_settings != (device.baud_rate, device.parity, device.stop_bits):
+                logger.error(
+                    f"{alias} has different serial settings than {', '.join(sorted(endpoint.aliases))} on the same bus {device.serial_port}. "
+                    f"Using {endpoint.baud_rate} baud, parity {endpoint.parity}, {endpoint.stop_bits} stop bits"
+                )
+            endpoint.aliases.add(alias)
+
+            # The shared client pipelines as deep as its most demanding device. Each device still caps its own requests
+            endpoint.max_in_flight = max(endpoint.max_in_flight, device.max_in_flight)
+
+        for key, endpoint in list(self.endpoints.items()):
+            new = wanted.get(key)
+            if new is None or new.max_in_flight != endpoint.max_in_flight or new.line_settings != endpoint.line_settings:
+                endpoint.close()
+                del self.endpoints[key]
+            else:
+                endpoint.aliases = new.aliases
+
+        for key, endpoint in wanted.items():
+            self.endpoints.setdefault(key, endpoint)
+
+        shared = [e for e in self.endpoints.values() if len(e.aliases) > 1]
+        if shared:
+            logger.info(f"Sharing connections: {', '.join(f'{e} ({len(e.aliases)} devices)' for e in shared)}")
+
+    def is_backing_off(self, device: Device) -> bool:
+        endpoint = self.endpoints.get(self.endpoint_key(device))
+        return endpoint is not None and time.monotonic() < endpoint.disabled_until
+
+    async def get_client(self, device: Device) -> ModbusBaseClient:
+        """ The connected client for the device's endpoint, connecting it if needed """
+
+        key = self.endpoint_key(device)
+        endpoint = self.endpoints.get(key)
+        if endpoint is None:
+            endpoint = self.endpoints[key] = self._new_endpoint(device)
+            endpoint.aliases.add(device.alias)
+            endpoint.max_in_flight = device.max_in_flight
+
+        # Only one of the devices sharing the endpoint connects at a time
+        async with endpoint.connecting:
+            if endpoint.client is not None and endpoint.client.connected:
+                return endpoint.client
+
+            if time.monotonic() < endpoint.disabled_until:
+                raise ConnectionError(f"{endpoint} is backing off after a failed connection")
+
+            endpoint.close()
+            conn = self._create_client(endpoint)
+
+            if await conn.connect():
+                endpoint.failures = 0
+                endpoint.client = conn
+                logger.info(f"Established connection: {conn}")
+                return conn
+
+            endpoint.failures += 1
+
+            backoff = min(self.base_backoff_seconds * (2 ** (min(endpoint.failures, 32) - 1)), self.max_backoff_seconds)
+            endpoint.disabled_until = time.monotonic() + backoff
+
+            logger.warning(f"{endpoint} unreachable ({', '.join(sorted(endpoint.aliases))}). Trying again in {backoff:.1f}s.")
+            raise ConnectionError("Could not connect to PLC", conn)
+
+    def report(self) -> list[str]:
+        """ Utilization of each connected serial bus """
+        return [e.client.report() for e in self.endpoints.values() if isinstance(e.client, SerialBusClient)]
+
+    def _create_client(self, endpoint: Endpoint) -> ModbusBaseClient:
+        match endpoint.protocol:
+            case Device.ProtocolChoices.MODBUS_TCP if endpoint.pipelined:
+                return PipelinedTcpClient(endpoint.host, port=endpoint.port, max_in_flight=endpoint.max_in_flight)
+
+            case Device.ProtocolChoices.MODBUS_TCP:
+                return AsyncModbusTcpClient(endpoint.host, port=endpoint.port, retries=0)
+
+            case Device.ProtocolChoices.MODBUS_UDP:
+                return AsyncModbusUdpClient(endpoint.host, port=endpoint.port, retries=0)
+
+            case Device.ProtocolChoices.MODBUS_RTU:
+                return SerialBusClient(endpoint.serial_port, baud_rate=endpoint.baud_rate, parity=endpoint.parity, stop_bits=endpoint.stop_bits)
+
+        raise ValueError(f"Unsupported protocol {endpoint.protocol}")
+
+
+pool = ConnectionPool()
@@ -37,14 +37,29 @@ class BaseCSVImporter:
     
 class DeviceImporter(BaseCSVImporter):
     model = Device
-    fields = ["alias", "ip_address", "port", "protocol", "word_order", "is_active"]
+    fields = ["alias", "ip_address", "port", "serial_port", "baud_rate", "parity", "stop_bits", "protocol", "word_order", "poll_rate", "max_in_flight", "request_timeout", "read_back_writes", "is_active"]
     required_fields = ["alias"]
     lookup_fields = ["alias"]
+
+    def clean_row(self, row: dict):
+        if "poll_rate" in row:
+            row["poll_rate"] = float(row["poll_rate"]) if row["poll_rate"] else None
+
+        if "request_timeout" in row:
+            row["request_timeout"] = float(row["request_timeout"]) if row["request_timeout"] else None
+
+        if "baud_rate" in row:
+            row["baud_rate"] = int(row["baud_rate"])
+
+        if "stop_bits" in row:
+            row["stop_bits"] = int(row["stop_bits"])
+
+        return super().clean_row(row)
     
 
 class TagImporter(BaseCSVImporter):
     model = Tag
-    fields = ["device", "unit_id", "alias", "description", "channel", "data_type", "address", "bit_index", "is_active", "restricted_write", "history_interval", "history_retention", "external_id"]
+    fields = ["device", "unit_id", "alias", "description", "channel", "data_type", "address", "bit_index", "is_active", "restricted_write", "scan_class", "deadband", "deadband_percent", "history_interval", "history_retention", "external_id"]
     required_fields = ["device", "alias", "channel", "data_type", "address"]
     lookup_fields = ["external_id"] #TODO?
 
@@ -59,6 +74,15 @@ class TagImporter(BaseCSVImporter):
         if "bit_index" in row:
             row["bit_index"] = int(row["bit_index"])
 
+        if "scan_class" in row:
+            row["scan_class"] = row["scan_class"] or Tag.ScanClassChoices.NORMAL
+
+        if "deadband" in row:
+            row["deadband"] = float(row["deadband"] or 0)
+
+        if "deadband_percent" in row:
+            row["deadband_percent"] = float(row["deadband_percent"] or 0)
+
         if "history_interval" in row:
             row["history_interval"] = parse_duration(row["history_interval"]) 
 
@@ -110,12 +134,12 @@ class BaseCSVExporter:
 
 class DeviceExporter(BaseCSVExporter):
     model = Device
-    fields = ["alias", "ip_address", "port", "protocol", "word_order", "is_active"]
+    fields = ["alias", "ip_address", "port", "serial_port", "baud_rate", "parity", "stop_bits", "protocol", "word_order", "poll_rate", "max_in_flight", "request_timeout", "read_back_writes", "is_active"]
 
 
 class TagExporter(BaseCSVExporter):
     model = Tag
-    fields = ["device", "alias", "description", "channel", "data_type", "address", "bit_index", "is_active", "restricted_write", "history_interval", "history_retention", "external_id"]
+    fields = ["device", "alias", "description", "channel", "data_type", "address", "bit_index", "is_active", "restricted_write", "scan_class", "deadband", "deadband_percent", "history_interval", "history_retention", "external_id"]
 
     def serialize_row(self, obj):
         row = super().serialize_row(obj)
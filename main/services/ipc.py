@@ -0,0 +1,150 @@
+import json
+import base64
+import asyncio
+import logging
+from collections import defaultdict
+from channels.layers import get_channel_layer
+from channels.db import database_sync_to_async
+from ..models import TagWriteRequest
+from .sharding import HashRing
+from .write_queue import write_queue
+from .subscriptions import subscriptions
+from .live_values import live_values
+
+
+logger = logging.getLogger(__name__)
+
+
+async def send_message(writer: asyncio.StreamWriter, message: dict):
+    """ Length-prefixed JSON frame """
+    data = json.dumps(message).encode()
+    writer.write(len(data).to_bytes(4, "big") + data)
+    await writer.drain()
+
+
+async def read_message(reader: asyncio.StreamReader) -> dict | None:
+    try:
+        header = await reader.readexactly(4)
+        return json.loads(await reader.readexactly(int.from_bytes(header, "big")))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class PollerHub:
+    """ Runs in the web process. Routes poller workers' updates to the subscribed consumers, and new writes to the worker owning the device,
+    and keeps every worker up to date on which tags live dashboards subscribe to """
+
+    def __init__(self, shards: int):
+        self.ring = HashRing(range(shards))
+        self.workers: dict[int, asyncio.StreamWriter] = {}
+        self.channel_layer = get_channel_layer()
+
+        # Tag updates received from each worker
+        self.received: dict[int, int] = defaultdict(int)
+
+    async def serve(self, port: int):
+        server = await asyncio.start_server(self._handle_worker, "127.0.0.1", port)
+        write_queue.attach(forward=self.forward_write)
+        subscriptions.on_change(self.send_demand)
+
+        logger.info(f"Poller hub listening on port {port}")
+        async with server:
+            await server.serve_forever()
+
+    def forward_write(self, alias: str, request_id: int):
+        """ Send the request to its device's worker. If that worker isn't connected, its backlog sweep will find it """
+
+        writer = self.workers.get(self.ring.owner(alias))
+        if writer is not None:
+            asyncio.create_task(send_message(writer, {"type": "write", "id": request_id}))
+
+    def send_demand(self):
+        for writer in self.workers.values():
+            asyncio.create_task(send_message(writer, {"type": "demand", "tags": subscriptions.live}))
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = await read_message(reader)
+        if not hello or hello.get("type") != "hello":
+            writer.close()
+            return
+
+        shard = hello["shard"]
+        self.workers[shard] = writer
+        logger.info(f"Poller worker {shard} connected")
+
+        await send_message(writer, {"type": "demand", "tags": subscriptions.live})
+
+        try:
+            while (message := await read_message(reader)) is not None:
+                match message.get("type"):
+                    case "tag_update":
+                        updates = [(tag_id, text, base64.b64decode(body)) for tag_id, text, body in message["updates"]]
+                        live_values.put(updates)
+                        self.received[shard] += len(updates)
+                        await subscriptions.publish(self.channel_layer, updates)
+                    case "read_times":
+                        live_values.touch(message["times"])
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Lost poller worker {shard}: {e}")
+        finally:
+            if self.workers.get(shard) is writer:
+                del self.workers[shard]
+            writer.close()
+            logger.info(f"Poller worker {shard} disconnected")
+
+
+class HubConnection:
+    """ Connection from a poller worker to the web process, which publishes the worker's updates """
+
+    def __init__(self, port: int, shard: int, reconnect_delay=2.0):
+        self.port = port
+        self.shard = shard
+        self.reconnect_delay = reconnect_delay
+        self.writer: asyncio.StreamWriter | None = None
+
+    async def publish(self, updates: list[tuple[str, str, bytes]]):
+        if self.writer is None:
+            return
+
+        # JSON can't carry the binary bodies as they are
+        updates = [(tag_id, text, base64.b64encode(body).decode()) for tag_id, text, body in updates]
+        try:
+            await send_message(self.writer, {"type": "tag_update", "updates": updates})
+        except OSError as e:
+            logger.warning(f"Couldn't reach the poller hub: {e}")
+
+    async def publish_read_times(self, read_times: dict[str, float]):
+        """ Pass on when tags were last read, which updates alone don't carry for steady values """
+        if self.writer is None:
+            return
+
+        try:
+            await send_message(self.writer, {"type": "read_times", "times": read_times})
+        except OSError as e:
+            logger.warning(f"Couldn't reach the poller hub: {e}")
+
+    async def run(self):
+        """ Stay connected to the hub, queueing the write requests it forwards and tracking live subscriptions """
+
+        @database_sync_to_async
+        def get_write_request(request_id: int):
+            return TagWriteRequest.objects.select_related("tag__device").filter(pk=request_id, processed=False).first()
+
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+                await send_message(self.writer, {"type": "hello", "shard": self.shard})
+
+                while (message := await read_message(reader)) is not None:
+                    match message.get("type"):
+                        case "write":
+                            if request := await get_write_request(message["id"]):
+                                write_queue.put(request.tag.device.alias, request)
+                        case "demand":
+                            subscriptions.set_live(message["tags"])
+
+            except OSError as e:
+                logger.warning(f"Couldn't reach the poller hub on port {self.port}: {e}")
+
+            self.writer = None
+            await asyncio.sleep(self.reconnect_delay)
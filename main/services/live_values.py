@@ -0,0 +1,116 @@
+import uuid
+import orjson
+from datetime import datetime, timezone as dt_timezone
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from channels.db import database_sync_to_async
+from ..models import Tag, ActivatedAlarm
+from .registry import registry
+from .runtime_tags import RuntimeTag
+from .tag_updates import encode_updates, update_read_ms, with_read_time
+
+
+def get_read_time(tag: Tag) -> datetime | None:
+    """ When the tag was last read. Uses the poller's records when it runs in this process, then the read times
+    sharded pollers report, otherwise the last DB checkpoint """
+
+    record = registry.tags.get(tag.id)
+    if record:
+        return record.read_at
+
+    read_ms = live_values.read_times.get(str(tag.external_id))
+    if read_ms is not None:
+        read_at = datetime.fromtimestamp(read_ms / 1000, tz=dt_timezone.utc)
+        if tag.last_updated is None or read_at > tag.last_updated:
+            return read_at
+
+    return tag.last_updated
+
+
+class LiveValueStore:
+    """ The latest update of each polled tag, keyed by external ID and kept encoded as it was sent to the websockets.
+    Seeded from the DB when the server starts, then kept current by the poller or, with sharded pollers, the hub.
+    Tags it doesn't hold fall back to the DB, so a process without a poller serves everything from there.
+
+    Updates are only sent when a value changes, so the poller also reports when each tag was last read.
+    Values are served with whichever time is later """
+
+    def __init__(self):
+        self.updates: dict[str, tuple[str, str, bytes]] = {}
+        self.read_times: dict[str, float] = {}
+
+    def put(self, updates: list[tuple[str, str, bytes]]):
+        for update in updates:
+            self.updates[update[0]] = update
+
+    def touch(self, read_times: dict[str, float]):
+        """ Record when tags were last read, in epoch ms, whether or not their values changed """
+        self.read_times.update(read_times)
+
+    def forget(self, external_id: str):
+        self.updates.pop(external_id, None)
+        self.read_times.pop(external_id, None)
+
+    def fresh(self, update: tuple[str, str, bytes]) -> tuple[str, str, bytes]:
+        """ The update with its tag's last read time """
+        read_ms = self.read_times.get(update[0])
+        if read_ms is None or read_ms <= (update_read_ms(update) or 0):
+            return update
+        return with_read_time(update, read_ms)
+
+    def seed(self) -> int:
+        """ Load every tag's last persisted value. Returns how many there are """
+        self.put(load_updates())
+        return len(self.updates)
+
+    def get(self, external_ids: list[str]) -> tuple[list[dict], list[str]]:
+        """ Values in the /api/values/ format, with the IDs that aren't held here """
+
+        now = timezone.now()
+        values, missing = [], []
+        for external_id in external_ids:
+            update = self.updates.get(external_id)
+            if update is None:
+                missing.append(external_id)
+                continue
+
+            value = orjson.loads(self.fresh(update)[1])
+            read_at = parse_datetime(value["time"]) if value["time"] else None
+            value["age"] = (now - read_at).total_seconds() * 1000 if read_at else "Infinity"
+            values.append(value)
+
+        return values, missing
+
+    async def snapshot(self, external_ids: list[str]) -> list[tuple[str, str, bytes]]:
+        """ Encoded updates for the tags, for a websocket that just subscribed to them """
+
+        updates = [self.fresh(self.updates[i]) for i in external_ids if i in self.updates]
+        missing = [i for i in external_ids if i not in self.updates]
+        if missing:
+            updates += await database_sync_to_async(load_updates)(missing)
+
+        return updates
+
+
+def load_updates(external_ids: list[str] | None = None) -> list[tuple[str, str, bytes]]:
+    """ Encode the tags' values as last persisted, for all tags or the given external IDs """
+
+    if external_ids is None:
+        tags = list(Tag.objects.all())
+        alarm_map = {a.config.tag_id: a for a in ActivatedAlarm.objects.filter(is_active=True).select_related("config")}
+    else:
+        tags = list(Tag.objects.filter(external_id__in=[i for i in external_ids if _is_uuid(i)]))
+        alarm_map = ActivatedAlarm.get_tag_map(tags)
+
+    return encode_updates([RuntimeTag(tag) for tag in tags], alarm_map)
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+live_values = LiveValueStore()
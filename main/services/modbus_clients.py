@@ -0,0 +1,232 @@
+import time
+import asyncio
+import logging
+import itertools
+from collections.abc import Awaitable
+from pymodbus.client import AsyncModbusSerialClient
+from pymodbus.client.mixin import ModbusClientMixin
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+from pymodbus.framer import FramerSocket, FramerType
+from pymodbus.pdu import DecodePDU, ModbusPDU
+
+
+logger = logging.getLogger(__name__)
+
+# Function codes that change device memory, which go ahead of reads on a serial bus
+WRITE_FUNCTION_CODES = {5, 6, 15, 16, 22, 23}
+
+
+class PipelinedTcpClient(ModbusClientMixin[Awaitable[ModbusPDU]]):
+    """ Modbus TCP client that keeps several transactions in flight, matching replies by transaction ID """
+
+    def __init__(self, host: str, port=502, max_in_flight=8, timeout=3.0):
+        ModbusClientMixin.__init__(self)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+
+        self.framer = FramerSocket(DecodePDU(False))
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.pending: dict[int, asyncio.Future] = {}
+        self.next_tid = 0
+
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.receive_task: asyncio.Task | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self) -> bool:
+        try:
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug(f"Pipelined connect to {self.host}:{self.port} failed: {e}")
+            return False
+
+        self.receive_task = asyncio.create_task(self._receive())
+        return True
+
+    def close(self):
+        if self.receive_task:
+            self.receive_task.cancel()
+            self.receive_task = None
+
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+        self._fail_pending(ConnectionException(f"Connection to {self} closed"))
+
+    async def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        """ Send the request as soon as an in-flight slot frees up, then wait for its matching reply """
+
+        async with self.slots:
+            if not self.connected:
+                raise ConnectionException(f"Not connected[{self}]")
+
+            request.transaction_id = self._get_next_tid()
+            future = asyncio.get_running_loop().create_future()
+            self.pending[request.transaction_id] = future
+
+            try:
+                self.writer.write(self.framer.buildFrame(request))
+                await self.writer.drain()
+
+                if no_response_expected:
+                    return None
+
+                response: ModbusPDU = await asyncio.wait_for(future, self.timeout)
+
+            finally:
+                self.pending.pop(request.transaction_id, None)
+
+        if response.dev_id != request.dev_id:
+            raise ModbusIOException(f"Request used device id={request.dev_id} but received {response.dev_id}")
+
+        return response
+
+    async def _receive(self):
+        """ Resolve pending transactions as their replies arrive, in any order """
+
+        buffer = b""
+        try:
+            while data := await self.reader.read(4096):
+                buffer += data
+
+                while buffer:
+                    used_len, pdu = self.framer.handleFrame(buffer, 0, 0)
+                    buffer = buffer[used_len:]
+                    if pdu is None:
+                        break
+
+                    future = self.pending.get(pdu.transaction_id)
+                    if future and not future.done():
+                        future.set_result(pdu)
+
+        except (OSError, ModbusIOException) as e:
+            logger.warning(f"Lost pipelined connection {self}: {e}")
+
+        finally:
+            if self.writer:
+                self.writer.close()
+                self.writer = None
+
+            self._fail_pending(ConnectionException(f"Connection to {self} lost"))
+
+    def _get_next_tid(self) -> int:
+        """ Transaction IDs wrap at 16 bits, skipping any still in flight """
+        while True:
+            self.next_tid = self.next_tid % 0xFFFF + 1
+            if self.next_tid not in self.pending:
+                return self.next_tid
+
+    def _fail_pending(self, exc: Exception):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    def __str__(self):
+        return f"{self.__class__.__name__} {self.host}:{self.port} (max in flight: {self.max_in_flight})"
+
+
+class SerialBusClient(ModbusClientMixin[Awaitable[ModbusPDU]]):
+    """ Modbus RTU client for one half-duplex serial bus, shared by every device on it.
+    Runs one transaction at a time with the inter-frame gap, sending writes ahead of reads """
+
+    def __init__(self, port: str, baud_rate=9600, parity="N", stop_bits=1, timeout=1.0):
+        ModbusClientMixin.__init__(self)
+        self.port = port
+        self.baud_rate = baud_rate
+        self.client = AsyncModbusSerialClient(
+            port, framer=FramerType.RTU, baudrate=baud_rate, parity=parity, stopbits=stop_bits, timeout=timeout, retries=0
+        )
+
+        # 3.5 character times of silence end a frame. Above 19200 baud the spec fixes it at 1.75ms
+        bits_per_char = 1 + 8 + (parity != "N") + stop_bits
+        self.frame_gap = 3.5 * bits_per_char / baud_rate if baud_rate <= 19200 else 0.00175
+
+        # Ordered by priority, then arrival. Each device waits on one request at a time, so arrival order takes turns between them
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.sequence = itertools.count()
+        self.worker: asyncio.Task | None = None
+
+        self.busy_time = 0.0
+        self.transactions = 0
+        self.report_start = time.monotonic()
+
+    @property
+    def connected(self) -> bool:
+        return self.worker is not None and self.client.connected
+
+    async def connect(self) -> bool:
+        if not await self.client.connect():
+            return False
+
+        self.worker = asyncio.create_task(self._run())
+        return True
+
+    def close(self):
+        if self.worker:
+            self.worker.cancel()
+            self.worker = None
+
+        self.client.close()
+
+        while not self.queue.empty():
+            *_, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(ConnectionException(f"Connection to {self} closed"))
+
+    async def execute(self, no_response_expected: bool, request: ModbusPDU) -> ModbusPDU:
+        """ Queue the request for the bus and wait for its turn and reply """
+
+        if not self.connected:
+            raise ConnectionException(f"Not connected[{self}]")
+
+        priority = 0 if request.function_code in WRITE_FUNCTION_CODES else 1
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self.sequence), no_response_expected, request, future))
+
+        return await future
+
+    def report(self) -> str:
+        """ Share of time the bus was busy since the last report """
+
+        now = time.monotonic()
+        elapsed = now - self.report_start
+        utilization = (self.busy_time / elapsed) * 100 if elapsed > 0 else 0
+        msg = f"{self}: bus {utilization:.1f}% busy, {self.transactions} transactions, {self.queue.qsize()} queued"
+
+        self.busy_time = 0.0
+        self.transactions = 0
+        self.report_start = now
+        return msg
+
+    async def _run(self):
+        """ Send queued requests one at a time, leaving the bus silent between frames """
+
+        while True:
+            _, _, no_response_expected, request, future = await self.queue.get()
+            if future.done():
+                continue
+
+            start_time = time.monotonic()
+            try:
+                response = await self.client.execute(no_response_expected, request)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(response)
+
+            await asyncio.sleep(self.frame_gap)
+
+            self.busy_time += time.monotonic() - start_time
+            self.transactions += 1
+
+    def __str__(self):
+        return f"{self.__class__.__name__} {self.port} @ {self.baud_rate}"
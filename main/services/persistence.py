@@ -0,0 +1,134 @@
+import time
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from django.db import connection, transaction
+from channels.db import database_sync_to_async
+from ..models import Tag, AlarmConfig, ActivatedAlarm
+from .runtime_tags import RuntimeTag
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """ Collects tag reads from the poller and writes them to the DB in batches, off the poll cycle """
+
+    def __init__(self, flush_interval=1.0, max_size=5000, checkpoint_interval=60.0, on_alarms_changed: Callable[[dict[int, ActivatedAlarm | None]], Awaitable] | None = None):
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.checkpoint_interval = checkpoint_interval
+        self.next_checkpoint = time.monotonic() + checkpoint_interval
+        self.on_alarms_changed = on_alarms_changed
+
+        # Keyed by tag ID, so repeated reads of a tag coalesce into its latest state.
+        # Changed values are flushed, while read times are only checkpointed now and then
+        self.read_tags: dict[int, RuntimeTag] = {}
+        self.updated_tags: dict[int, RuntimeTag] = {}
+        self.flush_now = asyncio.Event()
+
+        self.max_depth = 0
+        self.flush_count = 0
+        self.checkpoint_count = 0
+        self.total_flush_time = 0.0
+        self.max_flush_time = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self.updated_tags)
+
+    def put(self, read_tags: dict[int, RuntimeTag], updated_tags: dict[int, RuntimeTag]):
+        """ Queue the tags without waiting on the DB. Flushes early once the queue is full """
+
+        self.read_tags.update(read_tags)
+        self.updated_tags.update(updated_tags)
+        self.max_depth = max(self.max_depth, self.depth)
+
+        if self.depth >= self.max_size:
+            self.flush_now.set()
+
+    async def run(self):
+        """ Flush on the interval, or sooner if the queue fills up """
+
+        try:
+            while True:
+                try:
+                    async with asyncio.timeout(self.flush_interval):
+                        await self.flush_now.wait()
+                except TimeoutError:
+                    pass
+
+                self.flush_now.clear()
+                await self.flush()
+
+        except asyncio.CancelledError:
+            await self.flush(checkpoint=True)
+            raise
+
+    async def flush(self, checkpoint=False):
+        """ Write changed values, and every read time if a checkpoint is due """
+
+        start_time = time.monotonic()
+        checkpoint = checkpoint or start_time >= self.next_checkpoint
+
+        if not self.updated_tags and not (checkpoint and self.read_tags):
+            return
+
+        updated_tags, self.updated_tags = self.updated_tags, {}
+        if checkpoint:
+            read_tags, self.read_tags = self.read_tags, {}
+            self.next_checkpoint = start_time + self.checkpoint_interval
+        else:
+            read_tags = {}
+
+        try:
+            # Off the thread the web side's DB calls share, so a stalled write doesn't hold them up
+            alarm_changes = await database_sync_to_async(self._write, thread_sensitive=False)(read_tags, updated_tags)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(updated_tags)} values and {len(read_tags)} read times: {e}")
+
+            # Put the batch back unless newer reads already replaced it
+            self.read_tags = read_tags | self.read_tags
+            self.updated_tags = updated_tags | self.updated_tags
+            return
+
+        duration = time.monotonic() - start_time
+        self.flush_count += 1
+        self.checkpoint_count += checkpoint
+        self.total_flush_time += duration
+        self.max_flush_time = max(self.max_flush_time, duration)
+
+        if alarm_changes and self.on_alarms_changed:
+            await self.on_alarms_changed(alarm_changes)
+
+    def report(self) -> str:
+        """ Summary of queue depth and flush latency since the last report """
+
+        avg = self.total_flush_time / self.flush_count if self.flush_count else 0
+        msg = (
+            f"Persistence: {self.depth} queued (max {self.max_depth}), {self.flush_count} flushes, "
+            f"{self.checkpoint_count} checkpoints, average {avg:.3f}s, max {self.max_flush_time:.3f}s"
+        )
+
+        self.max_depth = self.depth
+        self.flush_count = self.checkpoint_count = 0
+        self.total_flush_time = self.max_flush_time = 0.0
+        return msg
+
+    def _write(self, read_tags: dict[int, RuntimeTag], updated_tags: dict[int, RuntimeTag]) -> dict[int, ActivatedAlarm | None]:
+        connection.ensure_connection()
+
+        # Model shells only exist for the length of the write
+        updated_models = [t.to_model() for t in updated_tags.values()]
+        read_models = [t.to_model() for t in read_tags.values() if t.id not in updated_tags]
+
+        with transaction.atomic():
+            Tag.objects.bulk_update(updated_models, ['current_value', 'last_updated'])
+            Tag.objects.bulk_update(read_models, ['last_updated'])
+            Tag.bulk_create_history(updated_models)
+            alarm_changes = AlarmConfig.update_alarms(updated_models)
+
+        for tag in updated_models:
+            updated_tags[tag.id].last_history_at = tag.last_history_at
+
+        return alarm_changes
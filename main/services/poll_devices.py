@@ -1,235 +1,533 @@
 import asyncio
 import time
+import math
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from collections import defaultdict
+from collections.abc import Awaitable, Callable, Iterable
+from functools import partial
 from django.utils import timezone
 from django.db import connection
-from pymodbus.client import AsyncModbusTcpClient, AsyncModbusUdpClient
 from pymodbus.client.base import ModbusBaseClient
 from channels.layers import get_channel_layer
 from channels.db import database_sync_to_async
-from ..models import Device, Tag, TagWriteRequest, AlarmConfig, ActivatedAlarm
-from ..api.serializers import TagValueSerializer
+from ..models import Device, Tag, TagWriteRequest, ActivatedAlarm
+from .registry import registry
+from .read_plan import ReadBlock, PlanCosts, compile_read_plan
+from .modbus_clients import PipelinedTcpClient
+from .connection_pool import pool
+from .runtime_tags import RuntimeTag
+from .persistence import WriteBehindQueue
+from .write_queue import write_queue
+from .write_plan import plan_writes
+from .timing_wheel import TimingWheel
+from .subscriptions import subscriptions
+from .tag_updates import encode_updates, epoch_ms
+from .live_values import live_values
 #from .notify_alarms import send_alarm_notifications #TODO use
 
 
 @dataclass
-class ReadBlock:
-    start: int
-    length: int
-    tags: list[Tag]
+class PollContext:
+    updated_tags: dict[int, RuntimeTag] = field(default_factory=dict)
+    read_tags: dict[int, RuntimeTag] = field(default_factory=dict)
 
 @dataclass
-class PollContext:
-    updated_tags: list[Tag]
-    read_tags: list[Tag]
+class ScanState:
+    """ One scan class of one device, fired by the timing wheel on its own period """
+    alias: str
+    scan_class: str
+    period: float
+    deadline: float
+    pending: bool = False
+
+@dataclass
+class ScanStats:
+    scans: int = 0
+    overruns: int = 0
+    total_duration: float = 0.0
+    max_duration: float = 0.0
 
 @dataclass
 class DeviceState:
-    failures: int = 0
     next_retry: float = 0.0
-    disabled_until: float = 0.0
+    total_duration: float = 0.0
+    iteration_count: int = 0
+    missed_cycles: int = 0
+
+    # Scans the wheel has fired that the device's task hasn't read yet
+    due: list[ScanState] = field(default_factory=list)
+
+    # Smoothed round trip time and its variation, as in TCP's retransmission timer
+    srtt: float | None = None
+    rttvar: float = 0.0
+
+    # Circuit breaker. Once open, the device is skipped until next_retry, then probed with a single read
+    errors: int = 0
+    trips: int = 0
+    breaker_open: bool = False
+
+    def get_timeout(self, device: Device) -> float:
+        if device.request_timeout:
+            return device.request_timeout
+        if self.srtt is None:
+            return MAX_TIMEOUT
+        return min(max(self.srtt + 4 * self.rttvar, MIN_TIMEOUT), MAX_TIMEOUT)
+
+    def record_success(self, rtt: float):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
 
-logger = logging.getLogger(__name__)
+        self.errors = 0
 
-channel_layer = get_channel_layer()
-clients: dict[str, ModbusBaseClient] = {}
-device_states: dict[str, DeviceState] = defaultdict(DeviceState)
+    def record_error(self) -> bool:
+        """ Count a failed request. Returns True if it opened the breaker """
+        self.errors += 1
+        if self.breaker_open or self.errors < BREAKER_THRESHOLD:
+            return False
 
+        self.trip()
+        return True
 
-async def poll_devices(poll_interval=0.25, info_interval=30):
-    """ Gather tag data and process write requests at a steady rate """
+    def trip(self):
+        """ Open the breaker, waiting longer after each failed probe """
+        self.breaker_open = True
+        self.trips += 1
+        self.next_retry = time.monotonic() + min(BREAKER_BASE_COOLDOWN * (2 ** (min(self.trips, 32) - 1)), BREAKER_MAX_COOLDOWN)
 
-    @database_sync_to_async
-    def get_active_devices() -> list[Device]:
-        """ Get devices enabled in the DB with prefetched tags """
-        return list(Device.objects.filter(is_active=True).prefetch_related('tags'))
+logger = logging.getLogger(__name__)
 
-    @database_sync_to_async
-    def update_tags(context: PollContext):
-        connection.ensure_connection()
+# Bounds for adaptive request timeouts, in seconds
+MIN_TIMEOUT = 0.25
+MAX_TIMEOUT = 3.0
 
-        Tag.objects.bulk_update(context.read_tags, ['last_updated'])
-        Tag.objects.bulk_update(context.updated_tags, ['current_value'])
-        Tag.bulk_create_history(context.updated_tags)
+# Consecutive failed requests that open a device's breaker, and how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_BASE_COOLDOWN = 2
+BREAKER_MAX_COOLDOWN = 60
 
-        AlarmConfig.update_alarms(context.updated_tags)
-    
-    @database_sync_to_async
-    def get_tag_data(context: PollContext):
-        serialized = TagValueSerializer(
-            context.updated_tags, many=True, 
-            context={"alarm_map": ActivatedAlarm.get_tag_map(context.updated_tags)}
-        )
-        return serialized.data
+publish_local = partial(subscriptions.publish, get_channel_layer())
+publish: Callable[[list[tuple[str, str, bytes]]], Awaitable] = publish_local
+publish_read_times: Callable[[dict[str, float]], Awaitable] | None = None
+device_states: dict[str, DeviceState] = defaultdict(DeviceState)
+device_tasks: dict[str, asyncio.Task] = {}
+scans: dict[tuple[str, str], ScanState] = {}
+scan_stats: dict[str, ScanStats] = defaultdict(ScanStats)
+wheel: TimingWheel | None = None
+pending_context = PollContext()
+alarm_map: dict[int, ActivatedAlarm] = {}
+persister: WriteBehindQueue | None = None
+
+
+async def poll_devices(poll_interval=0.25, info_interval=30, request_cost=0.01, register_cost=0.0001, flush_interval=1.0, flush_size=5000, checkpoint_interval=60.0, write_sweep_interval=30, fast_interval=0.1, slow_interval=30.0, scan_tick=0.02, demand_mode="off", publisher: Callable[[list[tuple[str, str, bytes]]], Awaitable] | None = None, read_time_publisher: Callable[[dict[str, float]], Awaitable] | None = None, read_time_interval=1.0):
+    """ Read each device's scan classes on their own periods, broadcasting their results at a steady rate and persisting them in the background.
+    Normal tags are read at the device's poll rate, or poll_interval if it has none. With a demand mode, tags nobody needs are skipped or demoted.
+    Read times are reported every read_time_interval, so live values stay fresh while unchanged.
+    A poller worker passes its own publishers to send both through the web process """
+
+    async def on_alarms_changed(changes: dict[int, ActivatedAlarm | None]):
+        """ Alarms are only known once persisted, so send their tags again """
+        for tag_id, alarm in changes.items():
+            if alarm:
+                alarm_map[tag_id] = alarm
+            else:
+                alarm_map.pop(tag_id, None)
+
+        await _broadcast([registry.tags[tag_id] for tag_id in changes if tag_id in registry.tags])
     
     async def log_duration(): #TODO more logging info?
-        """ Notify if we're keeping up with the target frequency """
-        nonlocal total_duration, iteration_count
+        """ Notify if each device and scan class is keeping up with its target frequency """
         while True:
-            if iteration_count > 0:
-                avg = total_duration / iteration_count
-                amt = (avg / poll_interval)*100 if poll_interval > 0 else 0
-                msg = f"Average poll duration: {avg:.3f}s ({amt:.2f}%)"
-                if avg > poll_interval:
-                    logger.warning(msg)
-                else:
-                    logger.info(msg)
-
-            total_duration = iteration_count = 0
             await asyncio.sleep(info_interval)
 
+            for alias, device in registry.devices.items():
+                state = device_states[alias]
+
+                if state.iteration_count > 0:
+                    avg = state.total_duration / state.iteration_count
+                    busy = state.total_duration / info_interval * 100
+                    msg = f"{alias}: average scan duration {avg:.3f}s (busy {busy:.2f}%), {state.missed_cycles} overruns, timeout {state.get_timeout(device):.3f}s"
+                    if state.missed_cycles:
+                        logger.warning(msg)
+                    else:
+                        logger.info(msg)
+
+                state.total_duration = state.iteration_count = state.missed_cycles = 0
+
+            for scan_class, stats in scan_stats.items():
+                if stats.scans or stats.overruns:
+                    avg = stats.total_duration / stats.scans if stats.scans else 0
+                    msg = f"Scan class {scan_class}: {stats.scans} scans, {stats.overruns} overruns, average {avg:.3f}s, max {stats.max_duration:.3f}s"
+                    if stats.overruns:
+                        logger.warning(msg)
+                    else:
+                        logger.info(msg)
+
+            scan_stats.clear()
+
+            logger.info(persister.report())
+
+            for msg in pool.report():
+                logger.info(msg)
+
     logger.info("Starting Async Poller...")
 
-    total_duration = iteration_count = 0
+    global pending_context, persister, publish, publish_read_times, wheel
+    if publisher is not None:
+        publish = publisher
+    publish_read_times = read_time_publisher
+
+    periods = {Tag.ScanClassChoices.FAST: fast_interval, Tag.ScanClassChoices.SLOW: slow_interval}
+
+    registry.costs = PlanCosts(request_cost, register_cost)
+    registry.set_demand_mode(demand_mode)
+    alarm_map.update(await _get_active_alarms())
+
+    write_queue.attach()
+    asyncio.create_task(write_queue.run_sweeps(write_sweep_interval))
+
+    persister = WriteBehindQueue(flush_interval, flush_size, checkpoint_interval, on_alarms_changed)
+    asyncio.create_task(persister.run())
     asyncio.create_task(log_duration())
+
+    wheel = TimingWheel(scan_tick)
+    asyncio.create_task(_run_scans())
+
+    # Broadcast often enough to pass on the fast scans
+    broadcast_interval = min(poll_interval, fast_interval)
+
+    # Config checks wait on the DB, so they run apart from the broadcasts
+    asyncio.create_task(_refresh_config(broadcast_interval, poll_interval, periods))
+
+    # Tags read since their read times were last reported
+    read_since: dict[int, RuntimeTag] = {}
+    next_read_report = time.monotonic() + read_time_interval
     
     while True:
         start_time = time.monotonic()
 
-        devices = await get_active_devices()
-        context = PollContext(updated_tags=[], read_tags=[])
-        
-        # Process devices concurrently
-        tasks = [_poll_device(d, context) for d in devices]
-        await asyncio.gather(*tasks)
-        await update_tags(context)
-
-        # Send data to the websocket using the tag serializer
-        tag_data = await get_tag_data(context)
-        await channel_layer.group_send(
-            "poller_broadcast", {
-                "type": "tag_update",
-                "updates": tag_data
-            }
-        )
+        if registry.update_demand():
+            _sync_scans(poll_interval, periods)
+
+        # Take everything the device loops have read since the last pass
+        context, pending_context = pending_context, PollContext()
+
+        persister.put(context.read_tags, context.updated_tags)
+
+        if context.updated_tags:
+            await _broadcast(list(context.updated_tags.values()))
+
+        read_since.update(context.read_tags)
+        if start_time >= next_read_report:
+            await _report_read_times(read_since.values())
+            read_since = {}
+            next_read_report = start_time + read_time_interval
 
         # Sleep
         elapsed = time.monotonic() - start_time
-        sleep_time = max(0, poll_interval - elapsed)
-
-        total_duration += elapsed
-        iteration_count += 1
+        sleep_time = max(0, broadcast_interval - elapsed)
 
         await asyncio.sleep(sleep_time)
 
 
-async def _poll_device(device: Device, context: PollContext):
-    """ Process read and writes for a device """
-    if time.monotonic() < device_states[device.alias].disabled_until:
-        return
-    
-    try:
-        client = await _get_client(device)
-    except Exception as e:
-        logger.warning(f"Couldn't connect to device {device}: {e}")
+async def _refresh_config(interval: float, poll_interval: float, periods: dict[str, float]):
+    """ Reload the registry when the config changes, along with the active alarms, since alarm config changes and deletions
+    only show up in the DB """
+
+    while True:
+        try:
+            if await registry.refresh():
+                _sync_device_tasks()
+                _sync_scans(poll_interval, periods)
+                await _reload_alarms()
+        except Exception as e:
+            logger.error(f"Error reloading the device registry: {e}")
+
+        await asyncio.sleep(interval)
+
+
+@partial(database_sync_to_async, thread_sensitive=False)
+def _get_active_alarms() -> dict[int, ActivatedAlarm]:
+    return {a.config.tag_id: a for a in ActivatedAlarm.objects.filter(is_active=True).select_related("config")}
+
+
+async def _reload_alarms():
+    """ Replace the alarm map with the active alarms in the DB, sending the tags whose alarm changed """
+
+    def key(alarm: ActivatedAlarm | None):
+        return alarm and (alarm.pk, alarm.config.external_id)
+
+    active = await _get_active_alarms()
+    changed = [tag_id for tag_id in alarm_map.keys() | active.keys() if key(alarm_map.get(tag_id)) != key(active.get(tag_id))]
+
+    alarm_map.clear()
+    alarm_map.update(active)
+
+    if changed:
+        await _broadcast([registry.tags[tag_id] for tag_id in changed if tag_id in registry.tags])
+
+
+async def _broadcast(tags: list[RuntimeTag]):
+    """ Send the tags' values to the subscribed websockets. Values polled in this process also go to its live value store """
+    updates = encode_updates(tags, alarm_map)
+    if publish is publish_local:
+        live_values.put(updates)
+    await publish(updates)
+
+
+async def _report_read_times(tags: Iterable[RuntimeTag]):
+    """ Tell the live value store when the tags were last read """
+    read_times = {tag.external_id: epoch_ms(tag.read_at) for tag in tags if tag.read_at is not None}
+    if not read_times:
         return
-    
-    await _process_writes(client, device)
-    
-    tags: list[Tag] = [t for t in device.tags.all() if t.is_active]
 
-    for block in _build_read_blocks(tags):
-        await _process_block(block, client, context)
+    if publish_read_times is None:
+        live_values.touch(read_times)
+    else:
+        await publish_read_times(read_times)
 
 
-async def _get_client(device: Device, base_backoff_seconds=2, max_backoff_seconds=60) -> ModbusBaseClient | None:
-    """Get or create a persistent client connection"""
+def _sync_device_tasks():
+    """ Start loops for new devices and stop loops for removed ones """
 
-    state = device_states[device.alias]
-    conn = clients.get(device.alias)
-
-    if conn is None or not conn.connected:
-        match device.protocol:
-            case Device.ProtocolChoices.MODBUS_TCP:
-                conn = AsyncModbusTcpClient(device.ip_address, port=device.port, retries=0)
-
-            case Device.ProtocolChoices.MODBUS_UDP:
-                conn = AsyncModbusUdpClient(device.ip_address, port=device.port, retries=0)
-            #case Device.ProtocolChoices.MODBUS_RTU:
-            #    conn = ModbusSerialClient(device.port)
-        if await conn.connect():
-            state.failures = 0
-            clients[device.alias] = conn
-            logger.info(f"Established connection: {conn}")
-        else:
-            state.failures += 1
+    for alias, task in list(device_tasks.items()):
+        if alias not in registry.devices or task.done():
+            task.cancel()
+            del device_tasks[alias]
 
-            backoff = min(base_backoff_seconds * (2 ** (min(state.failures, 32) - 1)), max_backoff_seconds)
-            state.disabled_until = time.monotonic() + backoff
+    pool.sync(registry.devices)
+
+    for alias in registry.devices:
+        if alias not in device_tasks:
+            device_tasks[alias] = asyncio.create_task(_run_device(alias))
 
-            logger.warning(f"{device.alias} unreachable. Trying again in {backoff:.1f}s.")
-            raise ConnectionError("Could not connect to PLC", conn)
-    
-    return conn
 
+def _sync_scans(poll_interval: float, periods: dict[str, float]):
+    """ Put each device scan class with tags on the wheel, and take off the ones without """
 
-def _build_read_blocks(tags: list[Tag], max_gap=8, max_size=128) -> list[ReadBlock]:
-    """ Create blocks of contiguous registers in memory """
-    #if not all(tag.device == tags[0].device for tag in tags):
-    #    raise Exception("Tag device mismatch when building read block")
+    now = time.monotonic()
+    wanted = set()
 
-    # Group tags by channel
-    grouped_tags = defaultdict(list[Tag])
-    for tag in tags:
-        grouped_tags[tag.channel].append(tag)
+    for alias, plans in registry.plans.items():
+        device = registry.devices[alias]
 
-    blocks = []
+        for scan_class, plan in plans.items():
+            if not plan.blocks:
+                continue
 
-    for channel, channel_tags in grouped_tags.items():
-        channel_tags.sort(key=lambda x: x.address)
+            key = (alias, scan_class)
+            wanted.add(key)
+            period = periods.get(scan_class) or device.poll_rate or poll_interval
+
+            if key in scans:
+                scans[key].period = period
+            else:
+                scans[key] = ScanState(alias, scan_class, period, now)
+                wheel.schedule(scans[key], now)
 
-        # First block
-        block_tags = [channel_tags[0]]
-        block_start = channel_tags[0].address
-        block_end = block_start + channel_tags[0].get_read_count()
+    # Removed scans are dropped from the wheel when they next expire
+    for key in scans.keys() - wanted:
+        del scans[key]
 
-        # Create or extend blocks
-        for tag in channel_tags[1:]:
-            length = tag.get_read_count()
 
-            close_enough = (tag.address - block_end) <= max_gap
-            within_size = (tag.address + length - block_start) <= max_size
+async def _run_scans():
+    """ Advance the timing wheel each tick, handing due scans to their device's task """
+
+    while True:
+        now = time.monotonic()
+
+        for scan in wheel.expire(now):
+            if scans.get((scan.alias, scan.scan_class)) is not scan:
+                continue
 
-            if close_enough and within_size:
-                # Extend current block
-                block_tags.append(tag)
-                block_end = max(block_end, tag.address + length)
+            state = device_states[scan.alias]
+            stats = scan_stats[scan.scan_class]
 
+            if scan.pending:
+                # The last scan of this class hasn't finished, so skip this one
+                stats.overruns += 1
+                state.missed_cycles += 1
             else:
-                # Finish current block and start new block
-                blocks.append(ReadBlock(block_start, block_end - block_start, block_tags))
-                block_tags = [tag]
-                block_start = tag.address
-                block_end = block_start + length
+                scan.pending = True
+                state.due.append(scan)
+                write_queue.notify(scan.alias)
 
-        # Add last block
-        blocks.append(ReadBlock(block_start, block_end - block_start, block_tags))
+            # Advance by whole periods so a slow scan doesn't shift the schedule
+            scan.deadline += scan.period
+            if scan.deadline < now:
+                missed = math.ceil((now - scan.deadline) / scan.period)
+                scan.deadline += missed * scan.period
+                stats.overruns += missed
+                state.missed_cycles += missed
 
-    return blocks
+            wheel.schedule(scan, scan.deadline)
 
+        await asyncio.sleep(wheel.tick - now % wheel.tick)
 
-async def _process_block(block: ReadBlock, client: ModbusBaseClient, context: PollContext):
-    """ Read the given data from the device connection and update associated tags """
+
+async def _run_device(alias: str):
+    """ Read the device's due scans and send its writes as they arrive """
+
+    state = device_states[alias]
+
+    while alias in registry.devices:
+        # pymodbus and sync_to_async can finish a call rather than raise the cancel sent during it
+        if asyncio.current_task().cancelling():
+            raise asyncio.CancelledError
+
+        await write_queue.wait(alias)
+
+        device = registry.devices.get(alias)
+        if device is None:
+            break
+
+        due, state.due = state.due, []
+        for scan in due:
+            await _run_scan(device, scan)
+
+        if not due and write_queue.pending.get(alias):
+            try:
+                await _handle_writes(device)
+            except Exception as e:
+                logger.error(f"Error writing to device {alias}: {e}")
+
+
+async def _run_scan(device: Device, scan: ScanState):
+    """ Read the tags of one scan class, handing the results to the next persist/broadcast pass """
+
+    plan = registry.plans.get(device.alias, {}).get(scan.scan_class)
+    start_time = time.monotonic()
+    context = PollContext()
+
+    try:
+        if plan:
+            await _poll_device(device, context, plan.blocks)
+    except Exception as e:
+        logger.error(f"Error polling device {device.alias}: {e}")
+    finally:
+        scan.pending = False
+
+    pending_context.updated_tags.update(context.updated_tags)
+    pending_context.read_tags.update(context.read_tags)
+
+    duration = time.monotonic() - start_time
+    state = device_states[device.alias]
+    state.total_duration += duration
+    state.iteration_count += 1
+
+    stats = scan_stats[scan.scan_class]
+    stats.scans += 1
+    stats.total_duration += duration
+    stats.max_duration = max(stats.max_duration, duration)
+
+
+async def _poll_device(device: Device, context: PollContext, blocks: list[ReadBlock]):
+    """ Process writes for a device, then read the given blocks """
+    client = await _get_ready_client(device)
+    if client is None:
+        return
+    
+    await _process_writes(client, device)
+
+    state = device_states[device.alias]
+
+    if state.breaker_open and blocks:
+        # Half-open: a single read decides whether the device is healthy again
+        if not await _process_block(blocks[0], client, context, device):
+            state.trip()
+            logger.debug(f"{device.alias} still failing, next probe in {state.next_retry - time.monotonic():.1f}s")
+            return
+
+        state.breaker_open = False
+        state.trips = 0
+        logger.info(f"{device.alias} recovered, resuming polls")
+        blocks = blocks[1:]
+
+    if isinstance(client, PipelinedTcpClient):
+        # Send every block at once. The device's own limit keeps it from crowding out others sharing the connection
+        slots = asyncio.Semaphore(device.max_in_flight)
+
+        async def process_block(block: ReadBlock):
+            async with slots:
+                if not state.breaker_open:
+                    await _process_block(block, client, context, device)
+
+        await asyncio.gather(*(process_block(block) for block in blocks))
+    else:
+        for block in blocks:
+            if state.breaker_open:
+                break
+            await _process_block(block, client, context, device)
+
+
+async def _handle_writes(device: Device):
+    """ Send queued writes between polls """
+    client = await _get_ready_client(device)
+    if client is not None:
+        await _process_writes(client, device)
+
+
+async def _get_ready_client(device: Device) -> ModbusBaseClient | None:
+    """ The device's shared connection, or None while it's backing off, unreachable or its breaker is open """
+    state = device_states[device.alias]
+    if state.breaker_open and time.monotonic() < state.next_retry:
+        return None
+
+    if pool.is_backing_off(device):
+        return None
+    
+    try:
+        return await pool.get_client(device)
+    except Exception as e:
+        logger.warning(f"Couldn't connect to device {device}: {e}")
+        return None
+
+
+async def _process_block(block: ReadBlock, client: ModbusBaseClient, context: PollContext, device: Device, force_update=False) -> bool:
+    """ Read the given data from the device connection and update associated tags. Returns False if the read failed """
 
     read_func = {
         Tag.ChannelChoices.COIL: client.read_coils,
         Tag.ChannelChoices.DISCRETE_INPUT: client.read_discrete_inputs,
         Tag.ChannelChoices.HOLDING_REGISTER: client.read_holding_registers,
         Tag.ChannelChoices.INPUT_REGISTER: client.read_input_registers,
-    }[block.tags[0].channel]
+    }[block.channel]
+
+    state = device_states[device.alias]
+    timeout = state.get_timeout(device)
+    start_time = time.monotonic()
 
     # Get register data for this block
     try:
-        rr = await read_func(block.start, count=block.length, device_id=0)
+        # asyncio.timeout, since wait_for drops a cancel that arrives as the response does
+        async with asyncio.timeout(timeout):
+            rr = await read_func(block.start, count=block.length, device_id=block.unit_id)
+        error = None
     except Exception as e:
-        logger.error(f"Error reading block: {e}")
-        return
-    
-    if rr.isError():
-        logger.error(f"Modbus error while reading block starting at {block.start} (Tags: {block.tags})")
-        return
+        # pymodbus turns a cancelled request into its own error, which mustn't keep a stopping task running
+        if asyncio.current_task().cancelling():
+            raise asyncio.CancelledError from e
+
+        # It does the same for timeouts, instead of a TimeoutError
+        if time.monotonic() - start_time >= timeout:
+            error = f"Timed out after {timeout:.3f}s reading block starting at {block.start}"
+        else:
+            error = f"Error reading block: {e}"
+    else:
+        if rr.isError():
+            error = f"Modbus error while reading block starting at {block.start} (Tags: {[s.tag for s in block.slots]})"
+
+    if error:
+        if state.record_error():
+            logger.warning(f"{device.alias} failed {state.errors} requests in a row, skipping it for {state.next_retry - time.monotonic():.1f}s")
+        elif not state.breaker_open:
+            logger.error(error)
+        return False
+
+    state.record_success(time.monotonic() - start_time)
     
     if len(rr.registers) > 0:
         block_data = rr.registers
@@ -237,130 +535,88 @@ async def _process_block(block: ReadBlock, client: ModbusBaseClient, context: Po
         block_data = rr.bits
     else:
         logger.error("Modbus response contained no data")
-        return
+        return False
 
-    # For each tag, get the associated value found in the register data 
-    for tag in block.tags:
-        try:
-            # Get memory
-            offset = tag.address - block.start
-            length = tag.get_read_count() #TODO
+    if len(block_data) < block.length:
+        logger.error(f"Modbus response for block starting at {block.start} was too short ({len(block_data)} < {block.length})")
+        return False
 
-            if offset + length > len(block_data):
-                logger.error(f"Tag {tag} out of bounds in block read")
-                continue
-            
-            raw_slice = block_data[offset : offset + length]
-
-            # Convert the register data into typed value
-            if len(rr.registers) > 0:
-                values = client.convert_from_registers(
-                    raw_slice, 
-                    data_type=tag.pymodbus_datatype,
-                    word_order=tag.device.word_order
-                )
-                # Handle bit-indexing
-                if tag.is_bit_indexed:
-                    values = bool((values >> tag.bit_index) & 1)
-
-            elif len(rr.bits) > 0:
-                values = raw_slice if tag.read_amount > 1 else raw_slice[0]
-
-            # Update tag
-            if tag.current_value != values:
-                tag.current_value = values
-                context.updated_tags.append(tag)
-            
-            tag.last_updated = timezone.now()
-            context.read_tags.append(tag)
+    now = timezone.now()
 
-        except Exception as e:
-            logger.error(f"Error processing tag {tag.alias}: {e}")
+    # Decode every tag in the block at once, then update the ones that changed past their deadband
+    for slot, values in block.decode(block_data):
+        tag = slot.tag
+
+        if force_update or tag.has_changed(values):
+            tag.value = values
+            context.updated_tags[tag.id] = tag
+        
+        tag.read_at = now
+        context.read_tags[tag.id] = tag
+
+    return True
 
 
 async def _process_writes(client, device: Device):
-    """ Queries all PLC write requests and attempts to fullfill them """
+    """ Attempts to fullfill the write requests queued for the device """
 
-    @database_sync_to_async
-    def get_pending_writes(device: Device):
-        return list(
-            TagWriteRequest.objects
-            .filter(processed=False, tag__device=device)
-            .select_related("tag__device")
-        )
-    
     @database_sync_to_async
     def save_requests(requests: list[TagWriteRequest]):
         connection.ensure_connection()
         TagWriteRequest.objects.bulk_update(requests, ['processed'])
 
-    writes = await get_pending_writes(device)
+    writes = write_queue.take(device.alias)
 
     if not writes:
         return
 
-    for req in writes:
-        # Try to actually write the requested value
-        try:
-            await _write_value(client, req.tag, req.value)
-            logger.info(f"Processed write request for tag {req.tag}")
-
-        except Exception as e:
-            logger.error(f"Write failed for {req.tag}: {e}") #TODO mark write status as failed
-            #TODO 
+    # Release the requests however this ends, so the sweep can queue any left unprocessed
+    try:
+        written: dict[int, Tag] = {}
+
+        # Send the fewest frames that leave the device in the same state
+        for frame in plan_writes(device, writes):
+            tags = ", ".join(str(req.tag) for req in frame.requests)
+            try:
+                async with asyncio.timeout(device_states[device.alias].get_timeout(device)):
+                    result = await frame.send(client)
+                if result.isError():
+                    raise Exception(f"Modbus error: {result}")
+                logger.info(f"Processed write requests for tags {tags}")
+                written.update((req.tag_id, req.tag) for req in frame.requests)
+
+            except Exception as e:
+                if asyncio.current_task().cancelling():
+                    raise asyncio.CancelledError from e
+                logger.error(f"Write failed for {tags}: {e}") #TODO mark write status as failed
 
         # Mark as done
-        req.processed = True
+        for req in writes:
+            req.processed = True
+
+        await save_requests(writes)
 
-    await save_requests(writes)
+        if device.read_back_writes and written:
+            await _read_back(client, device, list(written.values()))
+    finally:
+        write_queue.done(writes)
         
 
-async def _write_value(client: ModbusBaseClient, tag: Tag, values):
-    """ Attempts to write a value to the tag's associated register(s) """
+async def _read_back(client: ModbusBaseClient, device: Device, tags: list[Tag]):
+    """ Re-read just the written tags and send their confirmed values right away """
 
-    # Keep it iterable
-    if not isinstance(values, list) and tag.data_type != Tag.DataTypeChoices.STRING:
-        values = [values]
+    tags = [registry.tags[t.id] for t in tags if t.id in registry.tags]
+    plan = compile_read_plan(device, tags, registry.costs)
 
-    # Make sure that the values are set to the tag's type
-    try:
-        match tag.data_type:
-            case Tag.DataTypeChoices.BOOL:
-                values = [bool(value) for value in values]
-            case Tag.DataTypeChoices.INT16 | Tag.DataTypeChoices.UINT16:
-                values = [int(value) for value in values]
-            case Tag.DataTypeChoices.FLOAT32:
-                values = [float(value) for value in values]
-    except ValueError:
-        logger.error(f"Data type mismatch in {tag}: trying to write {values} with type {tag.data_type}")
-        return
+    context = PollContext()
+    for block in plan.blocks:
+        await _process_block(block, client, context, device, force_update=True)
 
-    # Write the list to the device registers
-    match tag.channel:
-        case Tag.ChannelChoices.HOLDING_REGISTER:
-            # Bitmask write
-            if tag.is_bit_indexed:           
-                bit_mask = 1 << tag.bit_index
-                and_mask = 0xFFFF ^ bit_mask
-                or_mask = bit_mask if values[0] else 0x0000
-                result = await client.mask_write_register(address=tag.address, and_mask=and_mask, or_mask=or_mask, device_id=tag.unit_id)
-
-            # Normal direct write
-            else:
-                registers = client.convert_to_registers(values, data_type=tag.pymodbus_datatype, word_order=tag.device.word_order)
-                result = await client.write_registers(tag.address, registers, device_id=tag.unit_id)
+    if context.updated_tags:
+        persister.put(context.read_tags, context.updated_tags)
+        await _broadcast(list(context.updated_tags.values()))
 
-        case Tag.ChannelChoices.COIL:
-            result = await client.write_coils(tag.address, values, device_id=tag.unit_id)
 
-        case _:
-            logger.error("Tried to write with a read-only tag")
-            return
-    
-    if result.isError():
-        raise Exception(f"Modbus error: {result}")
-    
-    
 def _get_modbus_reader(client: ModbusBaseClient, tag: Tag):
     """ Returns the function needed for reading a tag """
     return {
@@ -0,0 +1,265 @@
+import math
+import logging
+import numpy as np
+from dataclasses import dataclass
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from functools import partial
+from pymodbus.client.base import ModbusBaseClient
+from ..models import Device, Tag
+from .runtime_tags import RuntimeTag
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class TagSlot:
+    """ Where a tag lives inside a block read. Only tags decoded one at a time carry their own decoder """
+    tag: RuntimeTag
+    offset: int
+    length: int
+    bit_index: int | None = None
+    decode: Callable[[list], object] | None = None
+
+class RegisterGroup:
+    """ Same-typed numeric tags in a block, decoded with one gather, word swap and byte view """
+
+    def __init__(self, slots: list[TagSlot], dtype: np.dtype, amount: int, reverse_words: bool):
+        self.slots = slots
+        self.dtype = dtype
+        self.words = dtype.itemsize // 2
+        self.amount = amount
+        self.reverse_words = reverse_words
+        self.index = np.array([np.arange(s.offset, s.offset + s.length) for s in slots], dtype=np.intp)
+
+    def decode(self, data: np.ndarray) -> Iterator[tuple[TagSlot, object]]:
+        words = data[self.index].reshape(-1, self.words)
+        if self.reverse_words:
+            words = words[:, ::-1]
+
+        values = np.ascontiguousarray(words, dtype=">u2").view(self.dtype).reshape(len(self.slots), self.amount)
+        return zip(self.slots, values[:, 0].tolist() if self.amount == 1 else values.tolist())
+
+
+class RegisterBitGroup:
+    """ Bit-indexed tags in a block, decoded with one shift and mask """
+
+    def __init__(self, slots: list[TagSlot]):
+        self.slots = slots
+        self.offsets = np.array([s.offset for s in slots], dtype=np.intp)
+        self.bits = np.array([s.bit_index for s in slots], dtype=np.uint16)
+
+    def decode(self, data: np.ndarray) -> Iterator[tuple[TagSlot, object]]:
+        return zip(self.slots, ((data[self.offsets] >> self.bits) & 1).astype(bool).tolist())
+
+
+class BitGroup:
+    """ Coil or discrete input tags of the same size in a block """
+
+    def __init__(self, slots: list[TagSlot], amount: int):
+        self.slots = slots
+        self.amount = amount
+        self.index = np.array([np.arange(s.offset, s.offset + s.length) for s in slots], dtype=np.intp)
+
+    def decode(self, data: np.ndarray) -> Iterator[tuple[TagSlot, object]]:
+        values = data[self.index].astype(bool)
+        return zip(self.slots, values[:, 0].tolist() if self.amount == 1 else values.tolist())
+
+
+class ScalarGroup:
+    """ Tags without a vectorized decoder, like strings, converted one at a time. A tag that fails to decode is skipped on its own """
+
+    def __init__(self, slots: list[TagSlot]):
+        self.slots = slots
+
+    def decode(self, data: np.ndarray) -> Iterator[tuple[TagSlot, object]]:
+        for slot in self.slots:
+            try:
+                yield slot, slot.decode(data[slot.offset : slot.offset + slot.length].tolist())
+            except Exception as e:
+                logger.error(f"Error decoding tag {slot.tag.alias}: {e}")
+
+
+@dataclass
+class ReadBlock:
+    unit_id: int
+    channel: str
+    start: int
+    length: int
+    slots: list[TagSlot]
+    groups: list[RegisterGroup | RegisterBitGroup | BitGroup | ScalarGroup]
+
+    def decode(self, data: list) -> Iterator[tuple[TagSlot, object]]:
+        """ Yields each tag slot with its value from the block's response data """
+        array = np.asarray(data, dtype=np.uint16)
+        for group in self.groups:
+            try:
+                pairs = group.decode(array)
+            except Exception as e:
+                logger.error(f"Error decoding tags {[s.tag.alias for s in group.slots]}: {e}")
+                continue
+
+            yield from pairs
+
+@dataclass
+class ReadPlan:
+    signature: tuple
+    blocks: list[ReadBlock]
+
+    def bind(self, tags: dict[int, RuntimeTag]):
+        """ Point the slots at the runtime records of the same tags """
+        for block in self.blocks:
+            for slot in block.slots:
+                slot.tag = tags[slot.tag.id]
+
+@dataclass
+class PlanCosts:
+    """ Estimated seconds spent per read request, and per register read that no tag uses """
+    request_cost: float = 0.01
+    register_cost: float = 0.0001
+
+
+# Most units a single read function code may request
+READ_LIMITS = {
+    Tag.ChannelChoices.COIL: 2000,
+    Tag.ChannelChoices.DISCRETE_INPUT: 2000,
+    Tag.ChannelChoices.HOLDING_REGISTER: 125,
+    Tag.ChannelChoices.INPUT_REGISTER: 125,
+}
+
+# Big-endian array types matching the register data types
+NUMPY_DATATYPES = {
+    Tag.DataTypeChoices.INT16: np.dtype(">i2"),
+    Tag.DataTypeChoices.UINT16: np.dtype(">u2"),
+    Tag.DataTypeChoices.INT32: np.dtype(">i4"),
+    Tag.DataTypeChoices.UINT32: np.dtype(">u4"),
+    Tag.DataTypeChoices.INT64: np.dtype(">i8"),
+    Tag.DataTypeChoices.UINT64: np.dtype(">u8"),
+    Tag.DataTypeChoices.FLOAT32: np.dtype(">f4"),
+    Tag.DataTypeChoices.FLOAT64: np.dtype(">f8"),
+}
+
+# Bits are packed 16 to a register on the wire
+BITS_PER_UNIT = {
+    Tag.ChannelChoices.COIL: 16,
+    Tag.ChannelChoices.DISCRETE_INPUT: 16,
+    Tag.ChannelChoices.HOLDING_REGISTER: 1,
+    Tag.ChannelChoices.INPUT_REGISTER: 1,
+}
+
+
+def plan_signature(device: Device, tags: list[RuntimeTag]) -> tuple:
+    """ Everything a read plan depends on. Plans only need rebuilding when this changes """
+    return (device.word_order, tuple(sorted(
+        (t.id, t.channel, t.unit_id, t.address, t.data_type, t.read_amount, t.bit_index) for t in tags
+    )))
+
+
+def compile_read_plan(device: Device, tags: list[RuntimeTag], costs: PlanCosts = PlanCosts()) -> ReadPlan:
+    """ Split each unit ID and channel into the block reads with the lowest estimated cost, with the location and decoder of each tag """
+
+    # Group tags by unit ID and channel, since each read targets one of each
+    grouped_tags = defaultdict(list[RuntimeTag])
+    for tag in tags:
+        grouped_tags[(tag.unit_id, tag.channel)].append(tag)
+
+    blocks = []
+
+    for (unit_id, channel), group_tags in grouped_tags.items():
+        sized = sorted(((t, t.read_count) for t in group_tags), key=lambda x: x[0].address)
+        unit_cost = costs.register_cost / BITS_PER_UNIT[channel]
+
+        for first, last in _partition(sized, READ_LIMITS[channel], costs.request_cost, unit_cost):
+            block_tags = sized[first:last]
+            block_start = block_tags[0][0].address
+            block_end = max(tag.address + length for tag, length in block_tags)
+            blocks.append(_compile_block(device, unit_id, channel, block_start, block_end, block_tags))
+
+    return ReadPlan(plan_signature(device, tags), blocks)
+
+
+def _partition(sized: list[tuple[RuntimeTag, int]], limit: int, request_cost: float, unit_cost: float) -> list[tuple[int, int]]:
+    """ Optimally split address-sorted tags into [first, last) runs that fit in one request """
+
+    # best[j] is the cheapest way to read the first j tags, cut[j] where its last run starts
+    best = [0.0] + [math.inf] * len(sized)
+    cut = [0] * (len(sized) + 1)
+
+    for i in range(len(sized)):
+        start = end = sized[i][0].address
+        wasted = 0
+
+        for j in range(i, len(sized)):
+            tag, length = sized[j]
+            wasted += max(0, tag.address - end)
+            end = max(end, tag.address + length)
+
+            # A tag too large for one request still gets a run of its own
+            if j > i and end - start > limit:
+                break
+
+            cost = best[i] + request_cost + wasted * unit_cost
+            if cost < best[j + 1]:
+                best[j + 1] = cost
+                cut[j + 1] = i
+
+    runs = []
+    last = len(sized)
+    while last > 0:
+        runs.append((cut[last], last))
+        last = cut[last]
+
+    return runs[::-1]
+
+
+def _compile_block(device: Device, unit_id: int, channel: str, start: int, end: int, sized_tags: list[tuple[RuntimeTag, int]]) -> ReadBlock:
+    slots = [
+        TagSlot(
+            tag=tag,
+            offset=tag.address - start,
+            length=length,
+            bit_index=tag.bit_index if tag.is_bit_indexed else None
+        )
+        for tag, length in sized_tags
+    ]
+    return ReadBlock(unit_id, channel, start, end - start, slots, _group_slots(device, channel, slots))
+
+
+def _group_slots(device: Device, channel: str, slots: list[TagSlot]) -> list:
+    """ Sort the block's tags into groups that can be decoded in a few array operations """
+
+    if channel in [Tag.ChannelChoices.COIL, Tag.ChannelChoices.DISCRETE_INPUT]:
+        by_amount = defaultdict(list[TagSlot])
+        for slot in slots:
+            by_amount[slot.tag.read_amount].append(slot)
+        return [BitGroup(group, amount) for amount, group in by_amount.items()]
+
+    by_type = defaultdict(list[TagSlot])
+    bit_slots = []
+    scalar_slots = []
+
+    for slot in slots:
+        if slot.bit_index is not None:
+            bit_slots.append(slot)
+        elif slot.tag.data_type in NUMPY_DATATYPES:
+            by_type[(slot.tag.data_type, slot.tag.read_amount)].append(slot)
+        else:
+            scalar_slots.append(slot)
+
+    reverse_words = device.word_order == Device.WordOrderChoices.LITTLE
+    groups = [RegisterGroup(group, NUMPY_DATATYPES[data_type], amount, reverse_words) for (data_type, amount), group in by_type.items()]
+
+    if bit_slots:
+        groups.append(RegisterBitGroup(bit_slots))
+    if scalar_slots:
+        for slot in scalar_slots:
+            slot.decode = _get_decoder(device, slot.tag)
+        groups.append(ScalarGroup(scalar_slots))
+
+    return groups
+
+
+def _get_decoder(device: Device, tag: RuntimeTag) -> Callable[[list], object]:
+    """ Returns a function converting the tag's slice of block data into its value """
+    return partial(ModbusBaseClient.convert_from_registers, data_type=tag.pymodbus_datatype, word_order=device.word_order)
@@ -0,0 +1,218 @@
+import time
+import logging
+from collections import defaultdict
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from channels.db import database_sync_to_async
+from ..models import Device, Tag, AlarmConfig, ActivatedAlarm, Schedule, ConfigVersion, MIN_POLL_RATE, MIN_REQUEST_TIMEOUT
+from .read_plan import ReadPlan, PlanCosts, compile_read_plan, plan_signature
+from .runtime_tags import RuntimeTag
+from .sharding import HashRing
+from .subscriptions import subscriptions
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRegistry:
+    """ Long-lived copy of the active devices and their tags, reloaded only when the config changes """
+
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self.devices: dict[str, Device] = {}
+        self.tags: dict[int, RuntimeTag] = {}
+        self.plans: dict[str, dict[str, ReadPlan]] = {}
+        self.costs = PlanCosts()
+        self.version: int | None = None
+        self.stale = True
+        self.next_check = 0.0
+
+        # When sharded, this process only loads the devices the ring assigns to its shard
+        self.shard: int | None = None
+        self.ring: HashRing | None = None
+
+        # In demand mode, tags nobody needs are left out of the plans ("skip") or read on the slow scan ("demote")
+        self.demand_mode = "off"
+        self.demand_changed = False
+        self.needed_ids: set[int] = set()
+        self.device_tags: dict[str, list[RuntimeTag]] = {}
+
+    def set_shard(self, shard: int, shards: int):
+        self.shard = shard
+        self.ring = HashRing(range(shards))
+        self.stale = True
+
+    def owns(self, alias: str) -> bool:
+        return self.ring is None or self.ring.owner(alias) == self.shard
+
+    def mark_stale(self):
+        self.stale = True
+
+    def set_demand_mode(self, mode: str):
+        self.demand_mode = mode
+        if mode != "off":
+            subscriptions.on_change(self.mark_demand_changed)
+
+    def mark_demand_changed(self):
+        self.demand_changed = True
+
+    def update_demand(self) -> bool:
+        """ Recompile the plans affected by a change in live subscriptions. Returns True if plans were updated """
+        if not self.demand_changed:
+            return False
+
+        self.demand_changed = False
+        self._update_plans(self.device_tags)
+        return True
+
+    async def refresh(self) -> bool:
+        """ Reload if a change was signaled in this process or the shared config version moved. Returns True if reloaded """
+
+        now = time.monotonic()
+        if not self.stale and now < self.next_check:
+            return False
+
+        self.next_check = now + self.check_interval
+
+        # Not on the shared sync thread, which every websocket message also waits on
+        version = await database_sync_to_async(ConfigVersion.current, thread_sensitive=False)()
+        if not self.stale and version == self.version:
+            return False
+
+        self.stale = False
+        devices, device_rows, needed_ids = await database_sync_to_async(self._load, thread_sensitive=False)()
+        self.devices = devices
+        self.needed_ids = needed_ids
+        self.version = version
+        self.demand_changed = False
+
+        # The model rows are dropped once copied into the runtime records
+        self.device_tags = self._update_tags(device_rows)
+        self._update_plans(self.device_tags)
+
+        shard = f" for shard {self.shard}" if self.ring else ""
+        logger.info(f"Loaded {len(self.devices)} devices and {len(self.tags)} tags{shard} (config version {version})")
+        return True
+
+    def _update_tags(self, device_rows: dict[str, list[Tag]]) -> dict[str, list[RuntimeTag]]:
+        """ Refresh the runtime records, keeping the live values of tags that were already loaded. Returns the records by device alias """
+
+        tags = {}
+        device_tags = {}
+        for alias, rows in device_rows.items():
+            records = device_tags[alias] = []
+            for row in rows:
+                record = self.tags.get(row.pk)
+                if record:
+                    record.configure(row)
+                else:
+                    record = RuntimeTag(row)
+                tags[row.pk] = record
+                records.append(record)
+
+        self.tags = tags
+        return device_tags
+
+    def _update_plans(self, device_tags: dict[str, list[RuntimeTag]]):
+        """ Recompile read plans only for the device scan classes whose tags changed """
+
+        rebuilt = 0
+        idle = 0
+        plans = {}
+
+        for alias, device in self.devices.items():
+            class_tags = defaultdict(list[RuntimeTag])
+            for tag in device_tags.get(alias, []):
+                scan_class = tag.scan_class
+
+                if self.demand_mode != "off" and not self.is_needed(tag):
+                    idle += 1
+                    if self.demand_mode == "skip":
+                        continue
+                    scan_class = Tag.ScanClassChoices.SLOW
+
+                class_tags[scan_class].append(tag)
+
+            old_plans = self.plans.get(alias, {})
+            plans[alias] = {}
+
+            for scan_class, tags in class_tags.items():
+                plan = old_plans.get(scan_class)
+
+                if not plan or plan.signature != plan_signature(device, tags):
+                    plan = compile_read_plan(device, tags, self.costs)
+                    rebuilt += 1
+
+                # A kept plan may still point at records of tags that were deleted and loaded again
+                plan.bind(self.tags)
+                plans[alias][scan_class] = plan
+
+        self.plans = plans
+        logger.debug(f"Rebuilt {rebuilt} read plans")
+
+        if self.demand_mode != "off":
+            action = "skipped" if self.demand_mode == "skip" else "demoted to the slow scan"
+            logger.info(f"{idle} of {len(self.tags)} tags have no consumers and are {action}")
+
+    def is_needed(self, tag: RuntimeTag) -> bool:
+        """ If the tag is shown on a live dashboard, or has history, an alarm or a schedule """
+        return tag.id in self.needed_ids or subscriptions.is_live(tag.external_id)
+
+    def _load(self) -> tuple[dict[str, Device], dict[str, list[Tag]], set[int]]:
+        """ Get devices enabled in the DB that this process owns, their active tags by device alias,
+        and the IDs of tags needed without a live dashboard """
+
+        devices = {d.alias: d for d in Device.objects.filter(is_active=True) if self.owns(d.alias)}
+
+        # Rows saved without validation can be below the field minimums
+        for device in devices.values():
+            # A shorter poll rate would put the device on every tick of the timing wheel
+            if device.poll_rate is not None and device.poll_rate < MIN_POLL_RATE:
+                logger.warning(f"{device.alias} has a poll rate of {device.poll_rate}s, using {MIN_POLL_RATE}s")
+                device.poll_rate = MIN_POLL_RATE
+
+            # No read slots would leave every read waiting forever
+            if device.max_in_flight < 1:
+                logger.warning(f"{device.alias} allows {device.max_in_flight} reads in flight, using 1")
+                device.max_in_flight = 1
+
+            # Shorter timeouts would fail reads before the device could answer
+            if device.request_timeout is not None and device.request_timeout < MIN_REQUEST_TIMEOUT:
+                logger.warning(f"{device.alias} has a request timeout of {device.request_timeout}s, using {MIN_REQUEST_TIMEOUT}s")
+                device.request_timeout = MIN_REQUEST_TIMEOUT
+
+        aliases = {d.pk: d.alias for d in devices.values()}
+
+        device_tags = {alias: [] for alias in devices}
+        for tag in Tag.objects.filter(device_id__in=aliases, is_active=True):
+            device_tags[aliases[tag.device_id]].append(tag)
+
+        needed_ids = set()
+        if self.demand_mode != "off":
+            needed_ids.update(t.pk for rows in device_tags.values() for t in rows if t.history_retention.total_seconds() > 0)
+            needed_ids.update(AlarmConfig.objects.filter(enabled=True, tag__device_id__in=aliases).values_list("tag_id", flat=True))
+            needed_ids.update(Schedule.objects.filter(enabled=True, tag__device_id__in=aliases).values_list("tag_id", flat=True))
+
+        return devices, device_tags, needed_ids
+
+
+registry = DeviceRegistry()
+
+
+@receiver([post_save, post_delete], sender=Device)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=AlarmConfig)
+@receiver([post_save, post_delete], sender=Schedule)
+def _mark_registry_stale(sender, update_fields=None, **kwargs):
+    """ Reload on the next poller pass once the change is committed """
+    if update_fields and set(update_fields) <= {"last_notified", "last_run"}:
+        return
+    transaction.on_commit(registry.mark_stale)
+
+
+@receiver(post_delete, sender=ActivatedAlarm)
+def _mark_alarms_stale(sender, instance: ActivatedAlarm, **kwargs):
+    """ The poller still sends an active alarm deleted outside it until it reloads """
+    if instance.is_active:
+        transaction.on_commit(registry.mark_stale)
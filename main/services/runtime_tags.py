@@ -0,0 +1,93 @@
+import math
+from datetime import datetime, timedelta
+from pymodbus.client.base import ModbusBaseClient
+from ..models import Tag
+
+
+class RuntimeTag:
+    """ Compact in-memory record of a tag, holding only what polling, read planning and persistence need """
+
+    __slots__ = (
+        "id", "external_id", "alias", "unit_id", "channel", "data_type",
+        "address", "bit_index", "read_amount", "read_count", "is_bit_indexed", "pymodbus_datatype", "scan_class",
+        "deadband", "deadband_percent",
+        "value", "read_at",
+        "history_interval", "history_retention", "last_history_at",
+    )
+
+    def __init__(self, tag: Tag):
+        self.id: int = tag.pk
+        self.value = tag.current_value
+        self.read_at: datetime | None = tag.last_updated
+        self.last_history_at: datetime | None = tag.last_history_at
+        self.configure(tag)
+
+    def configure(self, tag: Tag):
+        """ Copy the tag's configuration, keeping the last read value and times """
+        self.external_id = str(tag.external_id)
+        self.alias: str = tag.alias
+        self.unit_id: int = tag.unit_id
+        self.channel: str = tag.channel
+        self.data_type: str = tag.data_type
+        self.address: int = tag.address
+        self.bit_index: int = tag.bit_index
+        self.read_amount: int = tag.read_amount
+        self.read_count: int = tag.get_read_count()
+        self.is_bit_indexed: bool = tag.is_bit_indexed
+        self.pymodbus_datatype: ModbusBaseClient.DATATYPE = tag.pymodbus_datatype
+        self.scan_class: str = tag.scan_class
+        self.deadband: float = max(tag.deadband, 0)
+        self.deadband_percent: float = max(tag.deadband_percent, 0)
+        self.history_interval: timedelta = tag.history_interval
+        self.history_retention: timedelta = tag.history_retention
+
+    def has_changed(self, value) -> bool:
+        """ If the value moved past the deadband, measured from the last reported value """
+
+        if not self.deadband and not self.deadband_percent:
+            return self.value != value
+
+        if isinstance(value, list):
+            return (
+                not isinstance(self.value, list) or len(value) != len(self.value)
+                or any(self._exceeds_deadband(old, new) for old, new in zip(self.value, value))
+            )
+
+        return self._exceeds_deadband(self.value, value)
+
+    def _exceeds_deadband(self, old, new) -> bool:
+        # Booleans and strings have no magnitude, so any difference counts
+        if not _is_number(old) or not _is_number(new):
+            return old != new
+
+        limit = max(self.deadband, abs(old) * self.deadband_percent / 100)
+        return not abs(new - old) <= limit
+
+    def to_model(self) -> Tag:
+        """ Unsaved Tag shell carrying the runtime state, for bulk updates and serialization """
+        return Tag(
+            id=self.id,
+            external_id=self.external_id,
+            alias=self.alias,
+            current_value=_json_value(self.value),
+            last_updated=self.read_at,
+            history_interval=self.history_interval,
+            history_retention=self.history_retention,
+            last_history_at=self.last_history_at,
+        )
+
+    def __str__(self):
+        return self.alias
+
+
+def _json_value(value):
+    """ JSON has no NaN or infinity, so they are stored as null, the same as websocket updates send them """
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, list):
+        return [_json_value(v) for v in value]
+    return value
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
@@ -3,6 +3,7 @@ import logging
 from django.utils import timezone
 from channels.db import database_sync_to_async
 from ..models import Schedule, TagWriteRequest
+from .write_queue import write_queue
 
 
 logger = logging.getLogger(__name__)
@@ -45,7 +46,8 @@ def process_schedules():
         if schedule.last_run and schedule.last_run >= scheduled_datetime:
             continue
 
-        TagWriteRequest.objects.create(tag=schedule.tag, value=schedule.write_value)
+        write_request = TagWriteRequest.objects.create(tag=schedule.tag, value=schedule.write_value)
+        write_queue.submit(write_request)
         logger.info(f"Schedule activated: {schedule.alias}")
 
         schedule.last_run = now
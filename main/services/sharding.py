@@ -0,0 +1,19 @@
+import bisect
+import hashlib
+from collections.abc import Iterable
+
+
+class HashRing:
+    """ Consistent hash ring. Adding or removing a node only moves the keys next to its points """
+
+    def __init__(self, nodes: Iterable[int], replicas=100):
+        self.points = sorted((_hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [h for h, _ in self.points]
+
+    def owner(self, key: str) -> int:
+        i = bisect.bisect(self.hashes, _hash(key)) % len(self.points)
+        return self.points[i][1]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
@@ -0,0 +1,141 @@
+import time
+from collections import defaultdict
+from django.utils import timezone
+from .tag_updates import format_time, pack_handle
+from collections.abc import Callable
+
+
+class SubscriptionIndex:
+    """ Which websocket consumers subscribe to which tags. Routes each update only to the consumers that want it,
+    and tells the poller which tags are live in demand mode.
+
+    Updates wait here until their consumer is ready for a frame, with newer values replacing older ones of the same tag.
+    A consumer has at most one wake-up message in the channel layer, so a slow client holds at most one pending update per tag """
+
+    def __init__(self, max_frame_rate=10.0, wake_timeout=30.0):
+        self.max_frame_rate = max_frame_rate
+        self.wake_timeout = wake_timeout
+        self.pending: dict[str, dict[str, tuple[str, str, bytes]]] = {}
+        self.woken: dict[str, float] = {}
+
+        self.subscriptions: dict[str, set[str]] = {}
+        self.subscribers: dict[str, set[str]] = {}
+
+        # A poller worker has no consumers, only the live tags the web process sends it
+        self.remote_live: set[str] = set()
+        self.listeners: list[Callable[[], None]] = []
+
+        # Small numbers standing in for tag IDs in binary frames, packed ahead of time. They stay the same for the life of the process
+        self.handles: dict[str, int] = {}
+        self.packed_handles: dict[str, bytes] = {}
+
+    @property
+    def frame_interval(self) -> float:
+        """ Shortest time between two frames to one consumer. A max_frame_rate of 0 means no limit """
+        return 1 / self.max_frame_rate if self.max_frame_rate > 0 else 0.0
+
+    def on_change(self, listener: Callable[[], None]):
+        """ Call the listener whenever a tag gains its first subscriber or loses its last """
+        self.listeners.append(listener)
+
+    def is_live(self, external_id: str) -> bool:
+        return external_id in self.subscribers or external_id in self.remote_live
+
+    @property
+    def live(self) -> list[str]:
+        return list(self.subscribers.keys() | self.remote_live)
+
+    def subscribe(self, consumer: str, external_ids):
+        tags = self.subscriptions.setdefault(consumer, set())
+        added = False
+
+        for tag_id in set(external_ids) - tags:
+            tags.add(tag_id)
+            added |= tag_id not in self.subscribers
+            self.subscribers.setdefault(tag_id, set()).add(consumer)
+
+        if added:
+            self._changed()
+
+    def unsubscribe(self, consumer: str, external_ids=None):
+        """ Drop the consumer's subscriptions to the given tags, or to every tag """
+
+        tags = self.subscriptions.get(consumer, set())
+        dropped = tags if external_ids is None else tags & set(external_ids)
+        removed = False
+
+        for tag_id in dropped:
+            consumers = self.subscribers[tag_id]
+            consumers.discard(consumer)
+            if not consumers:
+                del self.subscribers[tag_id]
+                removed = True
+
+        if external_ids is None or not (tags - dropped):
+            self.subscriptions.pop(consumer, None)
+            self.pending.pop(consumer, None)
+            self.woken.pop(consumer, None)
+        else:
+            tags -= dropped
+
+        if removed:
+            self._changed()
+
+    def get_handles(self, external_ids) -> dict[str, int]:
+        """ The tags' binary handles, assigning new ones as needed """
+        for tag_id in external_ids:
+            if tag_id not in self.handles:
+                self.handles[tag_id] = len(self.handles) + 1
+                self.packed_handles[tag_id] = pack_handle(self.handles[tag_id])
+
+        return {tag_id: self.handles[tag_id] for tag_id in external_ids}
+
+    def set_live(self, external_ids):
+        """ Replace the live tags known from the web process, as a poller worker does """
+        live = set(external_ids)
+        if live != self.remote_live:
+            self.remote_live = live
+            self._changed()
+
+    def route(self, updates: list[tuple[str, str, bytes]]) -> dict[str, list[tuple[str, str, bytes]]]:
+        """ Split encoded updates into the slice each subscribed consumer gets. Consumers with no matching tags are left out """
+
+        slices = defaultdict(list)
+        for update in updates:
+            for consumer in self.subscribers.get(update[0], ()):
+                slices[consumer].append(update)
+        return slices
+
+    async def publish(self, channel_layer, updates: list[tuple[str, str, bytes]]):
+        """ Queue each consumer's slice of the updates, waking it unless it's already due to send a frame """
+
+        now = time.monotonic()
+        for consumer, slice in self.route(updates).items():
+            pending = self.pending.setdefault(consumer, {})
+            for update in slice:
+                pending.pop(update[0], None)
+                pending[update[0]] = update
+
+            # Wake it again if the last wake-up may have expired in the channel layer
+            if now - self.woken.get(consumer, -self.wake_timeout) >= self.wake_timeout:
+                self.woken[consumer] = now
+                await channel_layer.send(consumer, {"type": "tag_update"})
+
+    def has_pending(self, consumer: str) -> bool:
+        return bool(self.pending.get(consumer))
+
+    def take(self, consumer: str) -> tuple[str, float, list[tuple[str, str, bytes]]]:
+        """ The consumer's pending updates, with the server time to measure their age against """
+
+        self.woken.pop(consumer, None)
+        updates = list(self.pending.pop(consumer, {}).values())
+
+        now = timezone.now()
+        return format_time(now), now.timestamp() * 1000, updates
+
+    def _changed(self):
+        for listener in self.listeners:
+            listener()
+
+
+subscriptions = SubscriptionIndex()
@@ -0,0 +1,132 @@
+import struct
+import orjson
+from functools import lru_cache
+from collections.abc import Iterable
+from datetime import datetime, timezone as dt_timezone
+from django.utils import timezone
+from ..models import Tag, ActivatedAlarm
+from .runtime_tags import RuntimeTag
+
+
+# Binary tag_update and snapshot frames: a frame type byte and the server time in epoch ms, then each update as
+# a 4 byte handle, a byte holding the value type and flags, the read time if set, the value, and the alarm ID if active.
+# JSON values are prefixed with a 4 byte length, since strings and arrays can be long. Little-endian throughout
+FRAME_TAG_UPDATE = 1
+FRAME_SNAPSHOT = 2
+
+VALUE_NULL = 0
+VALUE_FALSE = 1
+VALUE_TRUE = 2
+VALUE_INT32 = 3
+VALUE_FLOAT32 = 4
+VALUE_FLOAT64 = 5
+VALUE_JSON = 6
+
+HAS_TIME = 0x10
+HAS_ALARM = 0x20
+
+INT32_RANGE = range(-2 ** 31, 2 ** 31)
+
+
+def encode_updates(tags: list[RuntimeTag], alarm_map: dict[int, ActivatedAlarm]) -> list[tuple[str, str, bytes]]:
+    """ Each tag's update as (external ID, JSON text, binary body), encoded once however many consumers it goes to.
+    Ages are left to the client, which gets one server time per frame """
+
+    updates = []
+    for tag in tags:
+        alarm = alarm_map.get(tag.id)
+        alarm_id = str(alarm.config.external_id) if alarm else None
+
+        updates.append((
+            tag.external_id,
+            orjson.dumps({"id": tag.external_id, "value": tag.value, "time": format_time(tag.read_at), "alarm": alarm_id}).decode(),
+            _encode_binary(tag, alarm_id),
+        ))
+
+    return updates
+
+
+def build_frame(server_time: str, fragments: Iterable[str], frame_type="tag_update") -> str:
+    """ Splice encoded updates into a tag_update or snapshot frame without decoding them """
+    return f'{{"type":"{frame_type}","server_time":"{server_time}","data":[{",".join(fragments)}]}}'
+
+
+def build_binary_frame(server_ms: float, handles: dict[str, bytes], updates: Iterable[tuple[str, str, bytes]], frame_type=FRAME_TAG_UPDATE) -> bytes:
+    """ Splice binary update bodies behind the packed handles of their tags """
+    return struct.pack("<Bd", frame_type, server_ms) + b"".join(handles[tag_id] + body for tag_id, _, body in updates)
+
+
+def pack_handle(handle: int) -> bytes:
+    return struct.pack("<I", handle)
+
+
+@lru_cache(maxsize=1024)
+def format_time(value: datetime | None) -> str | None:
+    """ Same ISO 8601 format as DRF's DateTimeField. Cached, since every tag in a block shares its read time """
+    if value is None:
+        return None
+
+    value = timezone.localtime(value).isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+@lru_cache(maxsize=1024)
+def epoch_ms(value: datetime) -> float:
+    return value.timestamp() * 1000
+
+
+def update_read_ms(update: tuple[str, str, bytes]) -> float | None:
+    """ The read time carried by an encoded update, in epoch ms """
+    body = update[2]
+    return struct.unpack_from("<d", body, 1)[0] if body[0] & HAS_TIME else None
+
+
+def with_read_time(update: tuple[str, str, bytes], read_ms: float) -> tuple[str, str, bytes]:
+    """ The same update with a later read time, for a tag read again without its value changing """
+
+    external_id, text, body = update
+    value = orjson.loads(text)
+    value["time"] = format_time(datetime.fromtimestamp(read_ms / 1000, tz=dt_timezone.utc))
+
+    rest = body[9:] if body[0] & HAS_TIME else body[1:]
+    return external_id, orjson.dumps(value).decode(), struct.pack("<Bd", body[0] | HAS_TIME, read_ms) + rest
+
+
+@lru_cache(maxsize=1024)
+def _pack_time(value: datetime) -> bytes:
+    return struct.pack("<d", epoch_ms(value))
+
+
+def _encode_binary(tag: RuntimeTag, alarm_id: str | None) -> bytes:
+    value = tag.value
+
+    if value is None:
+        kind, data = VALUE_NULL, b""
+    elif isinstance(value, bool):
+        kind, data = (VALUE_TRUE if value else VALUE_FALSE), b""
+    elif isinstance(value, int) and value in INT32_RANGE:
+        kind, data = VALUE_INT32, struct.pack("<i", value)
+    elif isinstance(value, float) and tag.data_type == Tag.DataTypeChoices.FLOAT32:
+        # Values decoded from float32 registers lose nothing going back to 4 bytes
+        kind, data = VALUE_FLOAT32, struct.pack("<f", value)
+    elif isinstance(value, float):
+        kind, data = VALUE_FLOAT64, struct.pack("<d", value)
+    else:
+        text = orjson.dumps(value)
+        kind, data = VALUE_JSON, struct.pack("<I", len(text)) + text
+
+    parts = [b""]
+    if tag.read_at is not None:
+        kind |= HAS_TIME
+        parts.append(_pack_time(tag.read_at))
+
+    parts.append(data)
+
+    if alarm_id:
+        kind |= HAS_ALARM
+        parts.append(struct.pack("<B", len(alarm_id)) + alarm_id.encode())
+
+    parts[0] = struct.pack("<B", kind)
+    return b"".join(parts)
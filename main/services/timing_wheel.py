@@ -0,0 +1,38 @@
+import math
+import time
+
+
+class TimingWheel:
+    """ Hashed timing wheel. Timers go in the slot of the tick they expire on, so scheduling and expiring
+    cost the same however many are waiting. Timers more than one turn away wait in their slot until their tick comes around """
+
+    def __init__(self, tick=0.02, size=1024, now: float | None = None):
+        self.tick = tick
+        self.size = size
+        self.slots: list[list[tuple[int, object]]] = [[] for _ in range(size)]
+        self.current = math.floor((time.monotonic() if now is None else now) / tick)
+
+    def schedule(self, item, at: float):
+        """ Expire the item on the first tick at or after the given monotonic time """
+        tick = max(math.ceil(at / self.tick), self.current + 1)
+        self.slots[tick % self.size].append((tick, item))
+
+    def expire(self, now: float) -> list:
+        """ Advance to the given time, returning the items that expired on the way """
+
+        target = math.floor(now / self.tick)
+        expired = []
+
+        # One full turn visits every slot, so a long gap costs no more than that
+        for tick in range(self.current + 1, min(target, self.current + self.size) + 1):
+            slot = self.slots[tick % self.size]
+            if not slot:
+                continue
+
+            waiting = []
+            for entry in slot:
+                (expired if entry[0] <= target else waiting).append(entry)
+            self.slots[tick % self.size] = waiting
+
+        self.current = max(self.current, target)
+        return [item for _, item in sorted(expired, key=lambda e: e[0])]
@@ -0,0 +1,184 @@
+import logging
+from dataclasses import dataclass, field
+from collections import defaultdict
+from pymodbus.client.base import ModbusBaseClient
+from pymodbus.pdu import ModbusPDU
+from ..models import Device, Tag, TagWriteRequest
+
+
+logger = logging.getLogger(__name__)
+
+
+# Most units a single write function code may carry
+WRITE_REGISTERS_LIMIT = 123
+WRITE_COILS_LIMIT = 1968
+
+
+@dataclass
+class RegisterWrite:
+    """ FC16 write of consecutive holding registers """
+    unit_id: int
+    address: int
+    registers: list[int]
+    requests: list[TagWriteRequest]
+
+    async def send(self, client: ModbusBaseClient) -> ModbusPDU:
+        return await client.write_registers(self.address, self.registers, device_id=self.unit_id)
+
+@dataclass
+class CoilWrite:
+    """ FC15 write of consecutive coils """
+    unit_id: int
+    address: int
+    bits: list[bool]
+    requests: list[TagWriteRequest]
+
+    async def send(self, client: ModbusBaseClient) -> ModbusPDU:
+        return await client.write_coils(self.address, self.bits, device_id=self.unit_id)
+
+@dataclass
+class MaskWrite:
+    """ FC22 write of some bits in one holding register, leaving the others as they are """
+    unit_id: int
+    address: int
+    and_mask: int
+    or_mask: int
+    requests: list[TagWriteRequest]
+
+    async def send(self, client: ModbusBaseClient) -> ModbusPDU:
+        return await client.mask_write_register(address=self.address, and_mask=self.and_mask, or_mask=self.or_mask, device_id=self.unit_id)
+
+@dataclass
+class UnitWrites:
+    """ The final state each write leaves on one unit ID, by address """
+    registers: dict[int, int] = field(default_factory=dict)
+    masks: dict[int, tuple[int, int]] = field(default_factory=dict)
+    coils: dict[int, bool] = field(default_factory=dict)
+    owners: dict[tuple[str, int], list[TagWriteRequest]] = field(default_factory=lambda: defaultdict(list))
+
+
+def plan_writes(device: Device, requests: list[TagWriteRequest]) -> list[RegisterWrite | CoilWrite | MaskWrite]:
+    """ Turn pending write requests into as few frames as possible, with the same end result as sending them in order """
+
+    # Last value wins for each tag
+    latest: dict[int, TagWriteRequest] = {}
+    for req in requests:
+        latest.pop(req.tag_id, None)
+        latest[req.tag_id] = req
+
+    superseded = len(requests) - len(latest)
+    if superseded:
+        logger.info(f"Dropped {superseded} superseded write requests for {device.alias}")
+
+    units: dict[int, UnitWrites] = defaultdict(UnitWrites)
+    for req in latest.values():
+        try:
+            _apply_write(device, units[req.tag.unit_id], req)
+        except Exception as e:
+            # Left out of every frame, but still marked processed with the rest
+            logger.error(f"Write failed for {req.tag}: {e}")
+
+    frames = []
+    for unit_id, unit in units.items():
+        for start, end in _runs(unit.registers, WRITE_REGISTERS_LIMIT):
+            frames.append(RegisterWrite(
+                unit_id, start, [unit.registers[a] for a in range(start, end)], _owners(unit, "hr", start, end)
+            ))
+
+        for address, (and_mask, or_mask) in sorted(unit.masks.items()):
+            frames.append(MaskWrite(unit_id, address, and_mask, or_mask, _owners(unit, "mask", address, address + 1)))
+
+        for start, end in _runs(unit.coils, WRITE_COILS_LIMIT):
+            frames.append(CoilWrite(
+                unit_id, start, [unit.coils[a] for a in range(start, end)], _owners(unit, "coil", start, end)
+            ))
+
+    return frames
+
+
+def _apply_write(device: Device, unit: UnitWrites, req: TagWriteRequest):
+    """ Fold the request into the unit's final state """
+
+    tag = req.tag
+    values = _convert_values(tag, req.value)
+
+    match tag.channel:
+        case Tag.ChannelChoices.HOLDING_REGISTER if tag.is_bit_indexed:
+            bit_mask = 1 << tag.bit_index
+            and_mask = 0xFFFF ^ bit_mask
+            or_mask = bit_mask if values[0] else 0x0000
+
+            if tag.address in unit.registers:
+                # Apply it to the register already being written in full
+                unit.registers[tag.address] = (unit.registers[tag.address] & and_mask) | (or_mask & ~and_mask)
+                unit.owners[("hr", tag.address)].append(req)
+            else:
+                # Compose with earlier masks: the device sets (value & and) | (or & ~and)
+                prev_and, prev_or = unit.masks.get(tag.address, (0xFFFF, 0x0000))
+                unit.masks[tag.address] = (
+                    prev_and & and_mask,
+                    (prev_or & ~prev_and & and_mask) | (or_mask & ~and_mask)
+                )
+                unit.owners[("mask", tag.address)].append(req)
+
+        case Tag.ChannelChoices.HOLDING_REGISTER:
+            registers = ModbusBaseClient.convert_to_registers(values, data_type=tag.pymodbus_datatype, word_order=device.word_order)
+            for offset, register in enumerate(registers):
+                address = tag.address + offset
+                unit.registers[address] = register
+
+                # A full write replaces any earlier mask on the same register
+                unit.masks.pop(address, None)
+                unit.owners[("hr", address)].append(req)
+                unit.owners[("hr", address)].extend(unit.owners.pop(("mask", address), []))
+
+        case Tag.ChannelChoices.COIL:
+            for offset, bit in enumerate(values):
+                unit.coils[tag.address + offset] = bit
+                unit.owners[("coil", tag.address + offset)].append(req)
+
+        case _:
+            raise ValueError("Tried to write with a read-only tag")
+
+
+def _convert_values(tag: Tag, values):
+    """ Make sure that the values are set to the tag's type """
+
+    # Keep it iterable
+    if not isinstance(values, list) and tag.data_type != Tag.DataTypeChoices.STRING:
+        values = [values]
+
+    try:
+        match tag.data_type:
+            case Tag.DataTypeChoices.BOOL:
+                values = [bool(value) for value in values]
+            case Tag.DataTypeChoices.INT16 | Tag.DataTypeChoices.UINT16:
+                values = [int(value) for value in values]
+            case Tag.DataTypeChoices.FLOAT32:
+                values = [float(value) for value in values]
+    except (ValueError, TypeError):
+        raise ValueError(f"Data type mismatch: trying to write {values} with type {tag.data_type}")
+
+    return values
+
+
+def _runs(units: dict[int, object], limit: int) -> list[tuple[int, int]]:
+    """ Split the written addresses into [start, end) runs of consecutive addresses that fit in one frame """
+
+    runs = []
+    for address in sorted(units):
+        if runs and runs[-1][1] == address and address - runs[-1][0] < limit:
+            runs[-1][1] = address + 1
+        else:
+            runs.append([address, address + 1])
+
+    return [(start, end) for start, end in runs]
+
+
+def _owners(unit: UnitWrites, kind: str, start: int, end: int) -> list[TagWriteRequest]:
+    """ Requests that contributed to the given addresses, without repeats """
+    owners = {}
+    for address in range(start, end):
+        for req in unit.owners.get((kind, address), []):
+            owners[req.pk] = req
+    return list(owners.values())
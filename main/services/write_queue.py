@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from collections import defaultdict
+from collections.abc import Callable
+from channels.db import database_sync_to_async
+from ..models import TagWriteRequest
+from .registry import registry
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueue:
+    """ Hands new write requests straight to the poller's device tasks when the poller runs in this process """
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.pending: dict[str, list[TagWriteRequest]] = defaultdict(list)
+        self.events: dict[str, asyncio.Event] = defaultdict(asyncio.Event)
+        self.queued_ids: set[int] = set()
+        self.finished_ids: set[int] = set()
+        self.forward: Callable[[str, int], None] | None = None
+
+    def attach(self, forward: Callable[[str, int], None] | None = None):
+        """ Accept requests on the running loop, which belongs to the poller. With forward, requests are passed on by device alias and ID instead """
+        self.loop = asyncio.get_running_loop()
+        self.forward = forward
+
+    def submit(self, request: TagWriteRequest):
+        """ Queue a saved request from any thread. Without a poller here, the request is left for the backlog sweep """
+
+        if self.loop is None or self.loop.is_closed():
+            return
+
+        # Load the device here, since the poller can't query from the event loop
+        alias = request.tag.device.alias
+        self.loop.call_soon_threadsafe(self.put, alias, request)
+
+    def put(self, alias: str, request: TagWriteRequest):
+        if self.forward:
+            self.forward(alias, request.pk)
+            return
+
+        if request.pk in self.queued_ids or request.pk in self.finished_ids:
+            return
+
+        self.queued_ids.add(request.pk)
+        self.pending[alias].append(request)
+        self.notify(alias)
+
+    def notify(self, alias: str):
+        """ Wake the device's task, which also happens when its scans are due """
+        self.events[alias].set()
+
+    def take(self, alias: str) -> list[TagWriteRequest]:
+        return self.pending.pop(alias, [])
+
+    def done(self, requests: list[TagWriteRequest]):
+        ids = {r.pk for r in requests}
+        self.queued_ids -= ids
+        self.finished_ids |= ids
+
+    async def wait(self, alias: str, timeout: float | None = None) -> bool:
+        """ Sleep until the device is notified or the timeout passes. Returns True if notified """
+
+        event = self.events[alias]
+        try:
+            # asyncio.timeout rather than wait_for, which can swallow a cancel that lands as the event is set
+            async with asyncio.timeout(timeout):
+                await event.wait()
+        except TimeoutError:
+            return False
+
+        event.clear()
+        return True
+
+    async def sweep(self):
+        """ Queue unprocessed requests saved before the poller started, or by other processes """
+
+        @database_sync_to_async
+        def get_pending_writes():
+            return list(
+                TagWriteRequest.objects
+                .filter(processed=False, tag__device__is_active=True)
+                .select_related("tag__device")
+                .order_by("timestamp")
+            )
+
+        # Requests finished while the query runs may still show as unprocessed
+        self.finished_ids = set()
+
+        for request in await get_pending_writes():
+            if registry.owns(request.tag.device.alias):
+                self.put(request.tag.device.alias, request)
+
+    async def run_sweeps(self, interval=30):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error loading pending write requests: {e}")
+
+            await asyncio.sleep(interval)
+
+
+write_queue = WriteQueue()
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Device, Tag, AlarmConfig, ActivatedAlarm, Schedule, ConfigVersion
+from .services.live_values import live_values
+
+
+@receiver([post_save, post_delete], sender=Device)
+@receiver([post_save, post_delete], sender=Tag)
+def bump_config_version(sender, **kwargs):
+    """ Let pollers in any process know their device registry is out of date """
+    ConfigVersion.bump()
+
+
+@receiver([post_save, post_delete], sender=AlarmConfig)
+@receiver([post_save, post_delete], sender=Schedule)
+def bump_demand_version(sender, update_fields=None, **kwargs):
+    """ Alarms and schedules decide which tags the poller must read in demand mode """
+    if update_fields and set(update_fields) <= {"last_notified", "last_run"}:
+        return
+    ConfigVersion.bump()
+
+
+@receiver(post_delete, sender=ActivatedAlarm)
+def bump_alarm_version(sender, instance: ActivatedAlarm, **kwargs):
+    """ Pollers reload their active alarms with the registry """
+    if instance.is_active:
+        ConfigVersion.bump()
+
+
+@receiver(post_delete, sender=Tag)
+def forget_live_value(sender, instance: Tag, **kwargs):
+    live_values.forget(str(instance.external_id))
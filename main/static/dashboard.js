@@ -157,6 +157,9 @@ export class Dashboard {
         // Handle delete
         this.canvasGridStack.on('removed', (event, items) => {
             items.forEach(item => {
+                if(item.el.widgetInstance)
+                    this.listener.unregisterWidget(item.el.widgetInstance);
+
                 if(item.el.widgetInstance == this.selectedWidget) {
                     console.log("unselecting")
                     this.selectWidget(null);
@@ -278,7 +281,7 @@ export class Dashboard {
 
         if(widget) {
             widget.gridElem.classList.add("selected")
-            this.inspector.inspectWidget(widget);
+            this.inspector.inspectWidget(widget, this.listener);
             if(dashboardEdit)
                 activateTab(document.getElementById('inspect-button'));
         }
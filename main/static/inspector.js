@@ -2,6 +2,7 @@ import { serverCache, requestServer } from "./global.js";
 /** @import { InspectorFieldDefinition, ChoiceObject, DataType, TagObject, ChannelType, InspectorDataType, AlarmConfigObject, ScheduleObject } from "./types.js" */
 /** @import { Widget } from "./widgets.js" */
 /** @import { Dashboard } from "./dashboard.js" */
+/** @import { TagListener } from "./tag_listener.js" */
 
 //TODO might need some refactoring... we use very similar code for tag-dependent fields, create/edit/delete api calls for each object
 
@@ -295,8 +296,9 @@ export class Inspector {
     /**
      * Populate the form with properties of a given widget
      * @param {Widget} widget 
+     * @param {TagListener} [listener] Moves the widget's subscription when its tag changes
      */
-    inspectWidget(widget) {
+    inspectWidget(widget, listener) {
         /** @type {typeof Widget} */
         const widgetClass = widget.constructor;
 
@@ -346,7 +348,9 @@ export class Inspector {
             const tagOptions = compatibleTags.map(tag => ({ value: tag.external_id, label: Inspector.getTagLabel(tag) }));
 
             this.addField({ label: "Control Tag", type: "select", options: tagOptions }, widget.tag?.external_id, (newID) => {
+                listener?.unregisterWidget(widget);
                 widget.tag = serverCache.tags[newID];
+                listener?.registerWidget(widget);
                 widget.applyConfig();
                 createTagTypedFields(newID); // Update the tag based fields
             }, tagSection);
@@ -465,6 +469,21 @@ export class Inspector {
         locationSection.appendChild(restrictedWriteField.wrapper); // Move read-only field
 
         //const readAmount = this.addField({label: "Read Amount", type: "int"}, 1, null, tagSection)
+        const deadbandSection = this.addSection();
+        const scanClassOptions = serverCache.tagOptions.scan_classes.map(o => ({ value: o.value, label: o.label }));
+        const scanClass = this.addField({ label: "Scan Class", type: "select", options: scanClassOptions,
+                description: "How often the value is read. Normal uses the device's poll rate" },
+            tag?.scan_class || "normal", null, deadbandSection
+        );
+        const deadband = this.addField({ label: "Deadband", type: "number", 
+                description: "How much the value must change before it's updated. Use 0 to update on any change" },
+            tag?.deadband || 0, null, deadbandSection
+        );
+        const deadbandPercent = this.addField({ label: "Deadband (%)", type: "number", 
+                description: "How much the value must change, as a percent of the last value, before it's updated" },
+            tag?.deadband_percent || 0, null, deadbandSection
+        );
+
         const historySection = this.addSection();
         const historyRetention = this.addField({ label: "History Retention (Seconds)", type: "int", 
                 description: "The maximum age of this tag's history entries. Use 0 for no history" },
@@ -491,6 +510,9 @@ export class Inspector {
                 unit_id: 1,
                 //read_amount: readAmount.getValue(),
                 read_amount: 1,
+                scan_class: scanClass.getValue(),
+                deadband: deadband.getValue(),
+                deadband_percent: deadbandPercent.getValue(),
                 history_retention: historyRetention.getValue(),
                 history_interval: historyInterval.getValue(),
                 is_active: true,
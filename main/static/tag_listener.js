@@ -1,15 +1,30 @@
-import { requestServer } from "./global.js";
 /** @import { TagValueObject } from "./types.js" */
 /** @import { Widget } from "./widgets.js" */
 
+// Layout of binary tag_update and snapshot frames, matching main.services.tag_updates
+const FRAME_TAG_UPDATE = 1, FRAME_SNAPSHOT = 2;
+const VALUE_NULL = 0, VALUE_FALSE = 1, VALUE_TRUE = 2, VALUE_INT32 = 3, VALUE_FLOAT32 = 4, VALUE_FLOAT64 = 5, VALUE_JSON = 6;
+const HAS_TIME = 0x10, HAS_ALARM = 0x20;
+
+const textDecoder = new TextDecoder();
+
 /**
  * Dispatches incoming tag updates to registered widgets via WebSocket
  */
 export class TagListener {
-    constructor() {
+    /**
+     * @param {boolean} binary Ask the server for compact binary updates instead of JSON
+     */
+    constructor(binary = false) {
         /** @type {{ [tag_id: string]: Widget[] }} */
         this.tagMap = {};
 
+        /** @type {boolean} */
+        this.binary = binary;
+
+        /** @type {Map<number, string>} Tag IDs by the handles the server assigned them */
+        this.handles = new Map();
+
         /** @type {WebSocket | null} */
         this.socket = null;
 
@@ -18,26 +33,53 @@ export class TagListener {
     }
 
     /**
-     * Registers a widget to receive updates for its associated tag
+     * Registers a widget to receive updates for its associated tag, subscribing to the tag if the stream is already open
      * @param {Widget} widget 
      */
     registerWidget(widget) {
         if (!widget.tag) return;
-        this.tagMap[widget.tag.external_id] ??= [];
-        this.tagMap[widget.tag.external_id].push(widget);
+        const tagID = widget.tag.external_id;
+
+        if (!(tagID in this.tagMap)) {
+            this.tagMap[tagID] = [];
+            this.sendSubscription([tagID]);
+        }
+        this.tagMap[tagID].push(widget);
+    }
+
+    /**
+     * Stops sending updates to a widget, unsubscribing from its tag if no other widget uses it
+     * @param {Widget} widget 
+     */
+    unregisterWidget(widget) {
+        if (!widget.tag) return;
+        const tagID = widget.tag.external_id;
+        const widgets = (this.tagMap[tagID] ?? []).filter(w => w !== widget);
+
+        if (widgets.length > 0) {
+            this.tagMap[tagID] = widgets;
+            return;
+        }
+
+        delete this.tagMap[tagID];
+        if (this.socket?.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({
+                type: "unsubscribe",
+                tags: [tagID]
+            }));
+        }
     }
 
     /**
      * Establishes a WebSocket connection to the dashboard tag stream, retrying if failed.
-     * Fetches current values before subscribing to live updates
+     * The server sends a snapshot of the current values in reply to each subscription
      */
     async connect() {
         const protocol = window.location.protocol === "https:" ? "wss://" : "ws://";
         const path = `${protocol}${window.location.host}/ws/dashboard/`;
 
-        await this.fetchAll();
-
         this.socket = new WebSocket(path);
+        this.socket.binaryType = "arraybuffer";
 
         this.socket.onopen = () => {
             console.log("Connected to PLC Stream");
@@ -46,11 +88,24 @@ export class TagListener {
         };
 
         this.socket.onmessage = (e) => {
+            if (e.data instanceof ArrayBuffer) {
+                this.decodeFrame(e.data).forEach(update => this.onUpdate(update));
+                return;
+            }
+
             const payload = JSON.parse(e.data);
 
-            // main.consumers.tag_update
-            if (payload.type === "tag_update") {
+            // Handles for the binary protocol, sent in reply to a subscription
+            if (payload.type === "handles") {
+                Object.entries(payload.handles).forEach(([tagID, handle]) => this.handles.set(handle, tagID));
+            }
+
+            // main.consumers.tag_update, or the snapshot that follows a subscription
+            if (payload.type === "tag_update" || payload.type === "snapshot") {
+                // Ages are measured against the server's clock, which may not match this one
+                const serverTime = Date.parse(payload.server_time);
                 payload.data.forEach(update => {
+                    update.age = update.time ? serverTime - Date.parse(update.time) : Infinity;
                     this.onUpdate(update);
                 });
             }
@@ -63,36 +118,81 @@ export class TagListener {
         };
     }
 
-    /**
-     * Fetches the current values for all registered tags and sends them to widgets
-     */
-    async fetchAll() {
-        const tagIds = Object.keys(this.tagMap).join(",");
-        if (tagIds.length === 0) return;
-
-        await requestServer('/api/values/', 'GET', { tags: tagIds }, (response) => {
-            response.forEach(update => {
-                this.onUpdate(update);
-            });
-        });
-    }
-
     /**
      * Sends a list of tags to the server to recieve updates for
+     * @param {string[]} tagIds Defaults to every registered tag
      */
-    sendSubscription() {
+    sendSubscription(tagIds = Object.keys(this.tagMap)) {
         if (!this.socket || this.socket.readyState !== WebSocket.OPEN)
             return;
 
-        // Get all unique keys from the tagMap
-        const tagIds = Object.keys(this.tagMap);
-
         this.socket.send(JSON.stringify({
             type: "subscribe",
-            tags: tagIds
+            tags: tagIds,
+            protocol: this.binary ? "binary" : "json"
         }));
     }
 
+    /**
+     * Reads the updates out of a binary tag_update or snapshot frame
+     * @param {ArrayBuffer} buffer 
+     * @returns {TagValueObject[]}
+     */
+    decodeFrame(buffer) {
+        const view = new DataView(buffer);
+        const frameType = view.getUint8(0);
+        if (frameType !== FRAME_TAG_UPDATE && frameType !== FRAME_SNAPSHOT)
+            return [];
+
+        const serverTime = view.getFloat64(1, true);
+        const updates = [];
+        let offset = 9;
+
+        while (offset < view.byteLength) {
+            const handle = view.getUint32(offset, true);
+            const kind = view.getUint8(offset + 4);
+            offset += 5;
+
+            let time = null;
+            if (kind & HAS_TIME) {
+                time = view.getFloat64(offset, true);
+                offset += 8;
+            }
+
+            let value = null;
+            switch (kind & 0x0f) {
+                case VALUE_FALSE: value = false; break;
+                case VALUE_TRUE: value = true; break;
+                case VALUE_INT32: value = view.getInt32(offset, true); offset += 4; break;
+                case VALUE_FLOAT32: value = view.getFloat32(offset, true); offset += 4; break;
+                case VALUE_FLOAT64: value = view.getFloat64(offset, true); offset += 8; break;
+                case VALUE_JSON: {
+                    const length = view.getUint32(offset, true);
+                    value = JSON.parse(textDecoder.decode(new Uint8Array(buffer, offset + 4, length)));
+                    offset += 4 + length;
+                    break;
+                }
+            }
+
+            let alarm = null;
+            if (kind & HAS_ALARM) {
+                const length = view.getUint8(offset);
+                alarm = textDecoder.decode(new Uint8Array(buffer, offset + 1, length));
+                offset += 1 + length;
+            }
+
+            updates.push({
+                id: this.handles.get(handle),
+                value: value,
+                time: time === null ? null : new Date(time).toISOString(),
+                age: time === null ? Infinity : serverTime - time,
+                alarm: alarm,
+            });
+        }
+
+        return updates;
+    }
+
     /**
      * Dispatches a tag update to the relevant widgets
      * @param {TagValueObject} update 
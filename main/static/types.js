@@ -1,4 +1,5 @@
 /** @typedef {'coil' | 'di' | 'hr' | 'ir'} ChannelType */
+/** @typedef {'fast' | 'normal' | 'slow'} ScanClass */
 /** @typedef {'bool' | 'int16' | 'uint16' | 'int32' | 'uint32' | 'int64' | 'uint64' | 'float32' | 'float64' | 'string'} DataType */
 /** @typedef {'low' | 'high' | 'crit'} ThreatLevel */
 /** @typedef {'tcp' | 'udp' | 'rtu'} DeviceProtocol */
@@ -75,7 +76,8 @@
  * @typedef {Object} TagValueObject
  * @property {string} id The UUID of the tag
  * @property {string|number|boolean} value The current value of the tag
- * @property {number} age The age in seconds of the tag value
+ * @property {string} time When the value was last read
+ * @property {number} age The age in milliseconds of the tag value
  * @property {string} alarm The alarm ID associated with this tag, if active
  */
 
@@ -90,6 +92,9 @@
  * @property {ChannelType} channel The register type
  * @property {number} address The 0-indexed starting register
  * @property {number} [bit_index] Optional bit index (0-15)
+ * @property {ScanClass} scan_class How often the value is read
+ * @property {number} deadband Smallest absolute change that updates the value
+ * @property {number} deadband_percent Smallest change, as a percent of the last value, that updates the value
  * @property {number} history_retention Number of seconds that the value is stored in the DB
  * @property {number} history_interval Number of seconds between history value stores
  * @property {boolean} is_active If the tag can read/write data
@@ -103,6 +108,8 @@
  * @property {DeviceProtocol} protocol The type of Modbus connection
  * @property {string} ip_address IP used for Modbus connection
  * @property {string} port Port used for Modbus connection
+ * @property {string} serial_port Serial device used for Modbus RTU
+ * @property {number} baud_rate Serial line speed
  * @property {DeviceWordOrder} word_order Endianness of multi-byte data in the device
  */
 
@@ -111,6 +118,7 @@
  * @typedef {Object} TagOptionsObject
  * @property {ChoiceObject[]} channels Choices for tag channels
  * @property {ChoiceObject[]} data_types Choices for tag datatypes
+ * @property {ChoiceObject[]} scan_classes Choices for how often tags are read
  */
 
 /**
@@ -1,3 +1,275 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock
+from django.test import SimpleTestCase
+from pymodbus.client.base import ModbusBaseClient
+from .consumers import DashboardConsumer
+from .models import Device, Tag, TagWriteRequest
+from .services.connection_pool import ConnectionPool
+from .services.runtime_tags import RuntimeTag
+from .services.read_plan import PlanCosts, compile_read_plan, _partition
+from .services.subscriptions import SubscriptionIndex
+from .services.write_plan import CoilWrite, MaskWrite, RegisterWrite, plan_writes
 
-# Create your tests here.
+
+def make_tag(id: int, address: int, channel=Tag.ChannelChoices.HOLDING_REGISTER, data_type=Tag.DataTypeChoices.UINT16, **kwargs) -> RuntimeTag:
+    return RuntimeTag(Tag(id=id, alias=f"tag {id}", channel=channel, data_type=data_type, address=address, **kwargs))
+
+
+class ReadPlanTests(SimpleTestCase):
+    """ Splitting tags into block reads """
+
+    def blocks(self, tags, costs=PlanCosts()):
+        return [(b.unit_id, b.channel, b.start, b.length, [s.tag.id for s in b.slots]) for b in compile_read_plan(Device(alias="d"), tags, costs).blocks]
+
+    def test_contiguous_tags_share_a_block(self):
+        tags = [make_tag(i, i) for i in range(10)]
+        self.assertEqual(self.blocks(tags), [(1, "hr", 0, 10, list(range(10)))])
+
+    def test_gap_is_read_through_when_cheaper_than_a_request(self):
+        # 99 unused registers cost less than a round trip, 199 cost more
+        self.assertEqual(len(self.blocks([make_tag(1, 0), make_tag(2, 100)])), 1)
+        self.assertEqual(len(self.blocks([make_tag(1, 0), make_tag(2, 200)])), 2)
+
+    def test_register_blocks_stay_within_125(self):
+        blocks = self.blocks([make_tag(i, i) for i in range(130)])
+        self.assertEqual(sorted(b[3] for b in blocks), [5, 125])
+        self.assertEqual(sum((b[4] for b in blocks), []), list(range(130)))
+
+    def test_multi_register_tags_are_not_split(self):
+        tags = [make_tag(i, i * 2, data_type=Tag.DataTypeChoices.FLOAT32) for i in range(70)]
+        blocks = self.blocks(tags)
+        self.assertTrue(all(length <= 125 and length % 2 == 0 for _, _, _, length, _ in blocks))
+        self.assertEqual(sum(len(b[4]) for b in blocks), 70)
+
+    def test_bit_blocks_stay_within_2000(self):
+        coils = [make_tag(i, i, channel=Tag.ChannelChoices.COIL, data_type=Tag.DataTypeChoices.BOOL) for i in range(2100)]
+        self.assertEqual(sorted(b[3] for b in self.blocks(coils)), [100, 2000])
+
+    def test_unit_ids_and_channels_are_read_separately(self):
+        tags = [
+            make_tag(1, 0, unit_id=1), make_tag(2, 1, unit_id=1),
+            make_tag(3, 0, unit_id=2),
+            make_tag(4, 0, unit_id=1, channel=Tag.ChannelChoices.INPUT_REGISTER),
+        ]
+        self.assertCountEqual(self.blocks(tags), [
+            (1, "hr", 0, 2, [1, 2]),
+            (2, "hr", 0, 1, [3]),
+            (1, "ir", 0, 1, [4]),
+        ])
+
+    def test_partition_gives_oversized_tag_its_own_run(self):
+        sized = [(make_tag(1, 0), 1), (make_tag(2, 1), 150), (make_tag(3, 151), 1)]
+        self.assertEqual(_partition(sized, 125, 0.01, 0.0001), [(0, 1), (1, 2), (2, 3)])
+
+    def test_partition_finds_the_cheapest_split(self):
+        # Filling the first run up to the limit also takes two requests, but reads 47 unused registers
+        sized = [(make_tag(i, a), 1) for i, a in enumerate([0, 1, 2, 50, 51, 52])]
+        self.assertEqual(_partition(sized, 52, 1.0, 1.0), [(0, 3), (3, 6)])
+
+
+class BlockDecodeTests(SimpleTestCase):
+    """ Vectorized decoding of block reads, checked against pymodbus's own conversions """
+
+    VALUES = [
+        (Tag.DataTypeChoices.INT16, -1234),
+        (Tag.DataTypeChoices.UINT16, 54321),
+        (Tag.DataTypeChoices.INT32, -123456789),
+        (Tag.DataTypeChoices.UINT32, 3000000000),
+        (Tag.DataTypeChoices.INT64, -1234567890123),
+        (Tag.DataTypeChoices.UINT64, 12345678901234567),
+        (Tag.DataTypeChoices.FLOAT32, -2.25),
+        (Tag.DataTypeChoices.FLOAT64, 1234.5678),
+    ]
+
+    def decode(self, device: Device, tags: list[RuntimeTag], registers: list[int]) -> dict[int, object]:
+        blocks = compile_read_plan(device, tags).blocks
+        self.assertEqual(len(blocks), 1)
+        return {slot.tag.id: value for slot, value in blocks[0].decode(registers)}
+
+    def encode(self, device: Device, tags: list[RuntimeTag], values: list) -> list[int]:
+        registers = []
+        for tag, value in zip(tags, values):
+            registers += ModbusBaseClient.convert_to_registers(value, data_type=tag.pymodbus_datatype, word_order=device.word_order)
+        return registers
+
+    def test_numeric_types_in_both_word_orders(self):
+        for word_order in Device.WordOrderChoices:
+            with self.subTest(word_order=word_order):
+                device = Device(alias="d", word_order=word_order)
+
+                tags, address = [], 0
+                for i, (data_type, _) in enumerate(self.VALUES):
+                    tags.append(make_tag(i, address, data_type=data_type))
+                    address += tags[-1].read_count
+
+                values = [value for _, value in self.VALUES]
+                decoded = self.decode(device, tags, self.encode(device, tags, values))
+                self.assertEqual([decoded[t.id] for t in tags], values)
+
+    def test_arrays(self):
+        device = Device(alias="d", word_order=Device.WordOrderChoices.LITTLE)
+        tags = [
+            make_tag(1, 0, data_type=Tag.DataTypeChoices.INT16, read_amount=3),
+            make_tag(2, 3, data_type=Tag.DataTypeChoices.FLOAT32, read_amount=2),
+        ]
+        registers = self.encode(device, tags, [[1, -2, 3], [0.5, -8.0]])
+        self.assertEqual(self.decode(device, tags, registers), {1: [1, -2, 3], 2: [0.5, -8.0]})
+
+    def test_bit_indexed_registers(self):
+        tags = [make_tag(i, i // 2, data_type=Tag.DataTypeChoices.BOOL, bit_index=bit) for i, bit in enumerate([0, 15, 3, 4])]
+        decoded = self.decode(Device(alias="d"), tags, [0x8001, 0x0008])
+        self.assertEqual(decoded, {0: True, 1: True, 2: True, 3: False})
+
+    def test_coils(self):
+        tags = [
+            make_tag(1, 0, channel=Tag.ChannelChoices.COIL, data_type=Tag.DataTypeChoices.BOOL),
+            make_tag(2, 1, channel=Tag.ChannelChoices.COIL, data_type=Tag.DataTypeChoices.BOOL, read_amount=3),
+        ]
+        self.assertEqual(self.decode(Device(alias="d"), tags, [1, 0, 1, 1]), {1: True, 2: [False, True, True]})
+
+    def test_bad_string_only_skips_its_own_tag(self):
+        tags = [
+            make_tag(1, 0, data_type=Tag.DataTypeChoices.STRING, read_amount=4),
+            make_tag(2, 2, data_type=Tag.DataTypeChoices.STRING, read_amount=4),
+            make_tag(3, 4),
+        ]
+        with self.assertLogs("main.services.read_plan", "ERROR"):
+            decoded = self.decode(Device(alias="d"), tags, [0x4142, 0x4344, 0xFF00, 0xFE00, 7])
+        self.assertEqual(decoded, {1: "ABCD", 3: 7})
+
+
+class WritePlanTests(SimpleTestCase):
+    """ Merging write requests into frames """
+
+    def setUp(self):
+        self.device = Device(alias="d")
+        self.pk = 0
+
+    def request(self, tag: Tag, value) -> TagWriteRequest:
+        self.pk += 1
+        return TagWriteRequest(pk=self.pk, tag=tag, value=value)
+
+    def tag(self, id: int, address: int, channel=Tag.ChannelChoices.HOLDING_REGISTER, data_type=Tag.DataTypeChoices.UINT16, **kwargs) -> Tag:
+        return Tag(id=id, alias=f"tag {id}", device=self.device, channel=channel, data_type=data_type, address=address, **kwargs)
+
+    def test_latest_request_per_tag_wins(self):
+        tag = self.tag(1, 0)
+        first, last = self.request(tag, 1), self.request(tag, 2)
+        with self.assertLogs("main.services.write_plan", "INFO"):
+            frames = plan_writes(self.device, [first, last])
+        self.assertEqual(frames, [RegisterWrite(1, 0, [2], [last])])
+
+    def test_consecutive_registers_share_a_frame(self):
+        requests = [self.request(self.tag(i, 10 + i), i) for i in range(3)]
+        self.assertEqual(plan_writes(self.device, requests), [RegisterWrite(1, 10, [0, 1, 2], requests)])
+
+    def test_register_frames_stay_within_123(self):
+        requests = [self.request(self.tag(i, i), i) for i in range(130)]
+        frames = plan_writes(self.device, requests)
+        self.assertEqual([(f.address, len(f.registers)) for f in frames], [(0, 123), (123, 7)])
+
+    def test_coil_frames_stay_within_1968(self):
+        requests = [self.request(self.tag(i, i, Tag.ChannelChoices.COIL, Tag.DataTypeChoices.BOOL), True) for i in range(2000)]
+        frames = plan_writes(self.device, requests)
+        self.assertTrue(all(isinstance(f, CoilWrite) for f in frames))
+        self.assertEqual([(f.address, len(f.bits)) for f in frames], [(0, 1968), (1968, 32)])
+
+    def test_bit_writes_compose_into_one_mask(self):
+        set_bit = self.request(self.tag(1, 5, data_type=Tag.DataTypeChoices.BOOL, bit_index=0), True)
+        clear_bit = self.request(self.tag(2, 5, data_type=Tag.DataTypeChoices.BOOL, bit_index=3), False)
+        self.assertEqual(plan_writes(self.device, [set_bit, clear_bit]), [MaskWrite(1, 5, 0xFFFF ^ 0b1001, 0b0001, [set_bit, clear_bit])])
+
+    def test_bit_write_after_full_register_is_folded_in(self):
+        register = self.request(self.tag(1, 5), 0x00F0)
+        bit = self.request(self.tag(2, 5, data_type=Tag.DataTypeChoices.BOOL, bit_index=4), False)
+        self.assertEqual(plan_writes(self.device, [register, bit]), [RegisterWrite(1, 5, [0x00E0], [register, bit])])
+
+    def test_full_register_write_replaces_earlier_mask(self):
+        bit = self.request(self.tag(1, 5, data_type=Tag.DataTypeChoices.BOOL, bit_index=0), True)
+        register = self.request(self.tag(2, 5), 0x0100)
+        self.assertEqual(plan_writes(self.device, [bit, register]), [RegisterWrite(1, 5, [0x0100], [register, bit])])
+
+    def test_values_that_cant_be_encoded_only_drop_their_own_request(self):
+        valid = self.request(self.tag(1, 0), 5)
+        too_big = self.request(self.tag(2, 1, data_type=Tag.DataTypeChoices.INT16), 70000)
+        not_a_number = self.request(self.tag(3, 2, data_type=Tag.DataTypeChoices.INT32), "abc")
+        with self.assertLogs("main.services.write_plan", "ERROR") as logs:
+            frames = plan_writes(self.device, [valid, too_big, not_a_number])
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(frames, [RegisterWrite(1, 0, [5], [valid])])
+
+    def test_read_only_tags_are_not_written(self):
+        tag = self.tag(1, 0, Tag.ChannelChoices.INPUT_REGISTER)
+        with self.assertLogs("main.services.write_plan", "ERROR"):
+            self.assertEqual(plan_writes(self.device, [self.request(tag, 1)]), [])
+
+
+class SlowConsumerTests(SimpleTestCase):
+    """ Rate-limited frames to a client whose sends are slow """
+
+    async def test_updates_published_during_a_slow_send_are_still_sent(self):
+        index = SubscriptionIndex(max_frame_rate=10)
+        index.subscribe("c", ["tag"])
+
+        frames = []
+        consumer = DashboardConsumer()
+        consumer.channel_name = "c"
+        consumer.binary = False
+        consumer.next_frame = 0.0
+        consumer.flush_task = None
+
+        async def send(text_data=None, bytes_data=None):
+            frames.append(text_data)
+            await asyncio.sleep(0.05)
+        consumer.send = send
+
+        # Hand wake-ups to the consumer one at a time, as the channel layer does
+        inbox = asyncio.Queue()
+        class ChannelLayer:
+            async def send(self, channel, message):
+                inbox.put_nowait(message)
+
+        async def deliver():
+            while True:
+                await consumer.tag_update(await inbox.get())
+
+        with mock.patch("main.consumers.subscriptions", index):
+            delivery = asyncio.create_task(deliver())
+            for i in range(50):
+                await index.publish(ChannelLayer(), [("tag", f'{{"value":{i}}}', b"")])
+                await asyncio.sleep(0.02)
+            await asyncio.sleep(0.3)
+            delivery.cancel()
+
+        self.assertNotIn("c", index.pending)
+        self.assertGreater(len(frames), 5)
+        self.assertIn('{"value":49}', frames[-1])
+
+
+class RuntimeTagTests(SimpleTestCase):
+    """ Runtime records turned back into model rows for saving """
+
+    def test_values_json_cant_hold_are_saved_as_null(self):
+        tag = make_tag(1, 0, data_type=Tag.DataTypeChoices.FLOAT32)
+        tag.value = float("nan")
+        self.assertIsNone(tag.to_model().current_value)
+
+        tag.value = [1.5, float("inf"), -float("inf")]
+        self.assertEqual(tag.to_model().current_value, [1.5, None, None])
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """ Devices grouped onto shared connections """
+
+    def test_rtu_devices_on_one_port_share_its_line_settings(self):
+        pool = ConnectionPool()
+        devices = {
+            alias: Device(alias=alias, protocol=Device.ProtocolChoices.MODBUS_RTU, serial_port="/dev/ttyUSB0", baud_rate=19200)
+            for alias in ("a", "b")
+        }
+        pool.sync(devices)
+
+        endpoint, = pool.endpoints.values()
+        self.assertEqual((endpoint.serial_port, endpoint.baud_rate), ("/dev/ttyUSB0", 19200))
+        self.assertEqual((endpoint.host, endpoint.port), ("", 0))
+        self.assertEqual(endpoint.aliases, {"a", "b"})